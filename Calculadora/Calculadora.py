@@ -3,8 +3,15 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
+import os
 from datetime import datetime, timedelta
 
+import engine
+from engine import (years_to_double, scenario_final_values, sensitivity_grid, build_cash_flows, project_cash_flows,
+                    solve_required_contribution, solve_required_years, solve_required_rate, read_historical_returns,
+                    historical_summary, CASH_FLOW_TYPES, TIMELINES, MAX_SOLVER_YEARS, RATE_BOUNDS,
+                    HISTORICAL_RETURNS_FILE, HISTORICAL_TICKER, DEFAULT_BLOCK_MONTHS, WITHDRAWAL_RULES)
+
 # Configuración de la página
 st.set_page_config(
     page_title="📈 Calculadora de Inversión",
@@ -84,46 +91,11 @@ st.sidebar.markdown("""
 - Rendimiento esperado: 7-10%
 """)
 
-# Función principal de cálculo
-@st.cache_data
-def calculate_investment(initial, periodic, frequency, annual_ret, years):
-    monthly_return = (1 + annual_ret) ** (1/12) - 1
-    total_months = years * 12
-    
-    results = []
-    current_value = 0
-    total_invested = 0
-    
-    for month in range(total_months + 1):
-        # Determinar inversión del mes
-        if month == 0:
-            monthly_investment = initial
-        elif month % frequency == 0:
-            monthly_investment = periodic
-        else:
-            monthly_investment = 0
-        
-        # Actualizar totales
-        total_invested += monthly_investment
-        current_value += monthly_investment
-        
-        # Aplicar rendimiento mensual (excepto el primer mes)
-        if month > 0:
-            current_value *= (1 + monthly_return)
-        
-        profit = current_value - total_invested
-        
-        results.append({
-            'Mes': month,
-            'Año': month // 12,
-            'Inversión_Mensual': monthly_investment,
-            'Inversión_Acumulada': total_invested,
-            'Valor_Portafolio': current_value,
-            'Ganancia_Acumulada': profit,
-            'ROI_Porcentaje': (profit / total_invested * 100) if total_invested > 0 else 0
-        })
-    
-    return pd.DataFrame(results)
+# Cálculos del motor (engine.py) con la caché de Streamlit
+calculate_investment = st.cache_data(engine.calculate_investment)
+load_historical_returns = st.cache_data(engine.load_historical_returns)
+monte_carlo_projection = st.cache_data(engine.monte_carlo_projection)
+retirement_projection = st.cache_data(engine.retirement_projection)
 
 # Calcular los datos
 df = calculate_investment(
@@ -170,7 +142,8 @@ with col4:
 st.markdown("---")
 
 # Tabs para diferentes vistas
-tab1, tab2, tab3 = st.tabs(["📊 Gráficos", "📋 Tabla Detallada", "🔍 Análisis"])
+tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["📊 Gráficos", "📋 Tabla Detallada", "🔍 Análisis", "🎲 Monte Carlo",
+                                                    "🎯 Meta", "🗓️ Plan Flexible", "🏖️ Retiro"])
 
 with tab1:
     st.subheader("Crecimiento del Portafolio")
@@ -310,15 +283,10 @@ with tab3:
         st.write(f"**Múltiplo de inversión:** {final_data['Valor_Portafolio'] / final_data['Inversión_Acumulada']:.1f}x")
         
         # Tiempo para duplicar inversión
-        double_investment = final_data['Inversión_Acumulada'] * 2
-        years_to_double = None
-        for _, row in df.iterrows():
-            if row['Valor_Portafolio'] >= double_investment:
-                years_to_double = row['Año']
-                break
+        double_years = years_to_double(df)
         
-        if years_to_double:
-            st.write(f"**Años para duplicar inversión:** {years_to_double}")
+        if double_years:
+            st.write(f"**Años para duplicar inversión:** {double_years}")
     
     with col2:
         st.markdown("### 💡 Comparación de Escenarios")
@@ -330,22 +298,48 @@ with tab3:
             "Muy optimista (15%)": 0.15
         }
         
-        scenario_results = []
-        for name, rate in scenarios.items():
-            scenario_df = calculate_investment(
-                initial_investment, periodic_investment, 
-                investment_frequency, rate, investment_years
-            )
-            final_value = scenario_df.iloc[-1]['Valor_Portafolio']
-            scenario_results.append({
-                'Escenario': name,
-                'Rendimiento': f"{rate*100:.1f}%",
-                'Valor Final': f"${final_value:,.0f}"
-            })
-        
-        scenario_comparison = pd.DataFrame(scenario_results)
+        # Todas las tasas se evalúan a la vez como filas de una misma matriz
+        final_values = scenario_final_values(
+            initial_investment, periodic_investment,
+            investment_frequency, list(scenarios.values()), investment_years
+        )
+        scenario_comparison = pd.DataFrame({
+            'Escenario': list(scenarios),
+            'Rendimiento': [f"{rate*100:.1f}%" for rate in scenarios.values()],
+            'Valor Final': [f"${value:,.0f}" for value in final_values]
+        })
         st.dataframe(scenario_comparison, use_container_width=True)
     
+    st.markdown("---")
+    st.markdown("### 🌡️ Sensibilidad: Rendimiento × Aporte Periódico")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        rate_range = st.slider("Rango de rendimiento anual (%)", min_value=0.0, max_value=25.0, value=(2.0, 15.0), step=0.5)
+    with col2:
+        contribution_range = st.slider("Rango de aporte periódico ($)", min_value=0.0, max_value=5000.0,
+                                       value=(0.0, max(1000.0, periodic_investment * 2)), step=50.0)
+    with col3:
+        grid_horizon = st.selectbox("Horizonte (años)", options=sorted({10, 20, 30, 40, investment_years}),
+                                    index=sorted({10, 20, 30, 40, investment_years}).index(investment_years))
+    
+    grid_rates = np.linspace(rate_range[0], rate_range[1], 100) / 100
+    grid_contributions = np.linspace(contribution_range[0], contribution_range[1], 100)
+    grid = sensitivity_grid(initial_investment, grid_contributions, investment_frequency, grid_rates, [grid_horizon])[0]
+    
+    fig_heat = px.imshow(
+        grid,
+        x=np.round(grid_contributions, 0),
+        y=np.round(grid_rates * 100, 2),
+        origin='lower',
+        aspect='auto',
+        color_continuous_scale='Viridis',
+        labels={'x': 'Aporte periódico ($)', 'y': 'Rendimiento anual (%)', 'color': 'Valor final ($)'},
+        title=f"Valor Final a {grid_horizon} años"
+    )
+    fig_heat.update_layout(height=500)
+    st.plotly_chart(fig_heat, use_container_width=True)
+    
     st.markdown("---")
     st.markdown("### 🎯 Recomendaciones")
     
@@ -356,6 +350,283 @@ with tab3:
     else:
         st.warning("⚠️ **Portafolio Agresivo**: Asegúrate de estar cómodo con la volatilidad que esto implica.")
 
+with tab4:
+    st.subheader("🎲 Proyección Monte Carlo")
+    st.markdown("Miles de trayectorias con rendimientos aleatorios alrededor del rendimiento esperado, "
+                "con el mismo calendario de aportes. El rendimiento esperado se toma como tasa compuesta: "
+                "la trayectoria mediana coincide con la proyección de la pestaña Gráficos.")
+
+    returns_source = st.radio("📚 Fuente de rendimientos", ["Lognormal", "Histórico (bootstrap por bloques)"],
+                              horizontal=True,
+                              help="El bootstrap encadena bloques de meses reales: conserva las rachas y caídas "
+                                   "históricas (riesgo de secuencia de rendimientos)")
+    history, block_months, match_return = None, DEFAULT_BLOCK_MONTHS, False
+    if returns_source != "Lognormal":
+        uploaded_returns = st.file_uploader("Rendimientos mensuales (CSV con columnas fecha, rendimiento)", type="csv",
+                                            help=f"Si no subes un archivo se usa {os.path.basename(HISTORICAL_RETURNS_FILE)}")
+        if st.button("⬇️ Descargar / actualizar histórico",
+                     help=f"Descarga los rendimientos mensuales de {HISTORICAL_TICKER} con yfinance y los guarda en "
+                          f"{os.path.basename(HISTORICAL_RETURNS_FILE)}"):
+            try:
+                with st.spinner("Descargando rendimientos históricos..."):
+                    downloaded = engine.download_historical_returns()
+                load_historical_returns.clear()
+                st.success(f"✅ {len(downloaded)} meses guardados en {os.path.basename(HISTORICAL_RETURNS_FILE)}")
+            except ImportError:
+                st.error("❌ Hace falta yfinance para descargar el histórico (pip install yfinance)")
+            except Exception as e:
+                st.error(f"❌ No se pudo descargar el histórico: {e}")
+        history = read_historical_returns(uploaded_returns) if uploaded_returns else load_historical_returns()
+        if len(history) < 24:
+            st.warning("No hay suficientes rendimientos históricos (mínimo 24 meses). Descárgalos con el botón "
+                       "⬇️ o sube un CSV; mientras tanto se usa el modelo lognormal.")
+            history = None
+        else:
+            summary = historical_summary(history)
+            st.caption(f"{len(history)} meses ({history.index[0]:%Y-%m} a {history.index[-1]:%Y-%m}) · "
+                       f"rendimiento {summary['rendimiento']:.1%} anual · volatilidad {summary['volatilidad']:.1%} · "
+                       f"peor racha de 12 meses {summary['peor_12m']:.1%}")
+            col1, col2 = st.columns(2)
+            with col1:
+                block_months = st.slider("🧱 Meses por bloque", min_value=1, max_value=60, value=DEFAULT_BLOCK_MONTHS,
+                                         help="Bloques más largos conservan mejor las rachas; 1 = meses independientes")
+            with col2:
+                match_return = st.checkbox("Ajustar al rendimiento esperado de la barra lateral", value=False,
+                                           help="Desplaza el histórico para que su tasa compuesta sea tu rendimiento "
+                                                "esperado, igual que en el modo lognormal")
+            history = history.to_numpy()
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        annual_volatility = st.slider("📉 Volatilidad Anual (%)", min_value=0.0, max_value=40.0, value=15.0, step=0.5,
+                                      disabled=history is not None,
+                                      help="Desviación típica anual de los rendimientos (S&P 500 ≈ 15-20%)") / 100
+    with col2:
+        n_paths = st.select_slider("🔢 Trayectorias", options=[1000, 2000, 5000, 10000, 20000, 50000], value=10000)
+    with col3:
+        goal_value = st.number_input("🎯 Meta ($)", min_value=0.0, value=float(round(final_data['Valor_Portafolio'], -3)),
+                                     step=1000.0, help="Valor final que quieres alcanzar")
+    with col4:
+        seed = st.number_input("🌱 Semilla", min_value=0, value=42, step=1, help="Misma semilla = mismos resultados")
+
+    bands, final_values, goal_probability = monte_carlo_projection(
+        initial_investment, periodic_investment, investment_frequency, annual_return,
+        annual_volatility, investment_years, n_paths, int(seed), goal_value, history, block_months, match_return
+    )
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("🎯 Probabilidad de alcanzar la meta", f"{goal_probability:.1%}")
+    with col2:
+        st.metric("📉 Escenario pesimista (P5)", f"${bands['P5'].iloc[-1]:,.0f}")
+    with col3:
+        st.metric("📊 Mediana (P50)", f"${bands['P50'].iloc[-1]:,.0f}")
+    with col4:
+        st.metric("📈 Escenario optimista (P95)", f"${bands['P95'].iloc[-1]:,.0f}")
+
+    # Abanico de percentiles (bandas P5-P95 y P25-P75 alrededor de la mediana)
+    yearly_bands = bands[bands['Mes'] % 12 == 0]
+    years_axis = yearly_bands['Mes'] // 12
+    fig_fan = go.Figure()
+    for low, high, color, name in [('P5', 'P95', 'rgba(46,134,171,0.15)', 'P5 - P95'),
+                                   ('P25', 'P75', 'rgba(46,134,171,0.35)', 'P25 - P75')]:
+        fig_fan.add_trace(go.Scatter(x=years_axis, y=yearly_bands[high], mode='lines', line=dict(width=0),
+                                     showlegend=False, hoverinfo='skip'))
+        fig_fan.add_trace(go.Scatter(x=years_axis, y=yearly_bands[low], mode='lines', line=dict(width=0),
+                                     fill='tonexty', fillcolor=color, name=name))
+    fig_fan.add_trace(go.Scatter(x=years_axis, y=yearly_bands['P50'], mode='lines', name='Mediana',
+                                 line=dict(color='#2E86AB', width=3)))
+    fig_fan.add_trace(go.Scatter(x=years_axis, y=yearly_bands['Inversión_Acumulada'], mode='lines',
+                                 name='Total Invertido', line=dict(color='#A23B72', width=2, dash='dash')))
+    fig_fan.add_hline(y=goal_value, line_dash='dot', line_color='green', annotation_text='Meta')
+    fig_fan.update_layout(title="Rango de Resultados Posibles", xaxis_title="Años", yaxis_title="Valor ($)",
+                          hovermode='x unified', height=500)
+    st.plotly_chart(fig_fan, use_container_width=True)
+
+    fig_hist = px.histogram(x=final_values, nbins=80, title="Distribución del Valor Final",
+                            labels={'x': 'Valor Final ($)'}, color_discrete_sequence=['#2E86AB'])
+    fig_hist.add_vline(x=goal_value, line_dash='dot', line_color='green')
+    fig_hist.update_layout(height=400, showlegend=False, yaxis_title="Trayectorias")
+    st.plotly_chart(fig_hist, use_container_width=True)
+
+with tab5:
+    st.subheader("🎯 ¿Qué necesito para llegar a mi meta?")
+    st.markdown("Fija un valor final y calcula la variable que falta; el resto se toma de la configuración de la barra lateral.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        target_value = st.number_input("💰 Valor final deseado ($)", min_value=0.0,
+                                       value=float(round(final_data['Valor_Portafolio'] * 2, -3)), step=1000.0)
+    with col2:
+        solve_for = st.radio("🔍 Calcular", ["Aporte periódico", "Años necesarios", "Rendimiento anual"], horizontal=True)
+
+    if solve_for == "Aporte periódico":
+        required = float(solve_required_contribution(target_value, initial_investment, investment_frequency,
+                                                     annual_return, investment_years))
+        if not np.isfinite(required):
+            st.error("No se puede calcular el aporte con esta configuración.")
+        elif required == 0:
+            st.success("✅ La inversión inicial basta para llegar a la meta sin aportes periódicos.")
+        else:
+            st.metric(f"📅 Aporte necesario cada {investment_frequency} mes{'es' if investment_frequency > 1 else ''}",
+                      f"${required:,.2f}",
+                      delta=f"${required - periodic_investment:+,.2f} vs. actual")
+    elif solve_for == "Años necesarios":
+        required_months = float(solve_required_years(target_value, initial_investment, periodic_investment,
+                                                     investment_frequency, annual_return))
+        if np.isnan(required_months):
+            st.error(f"❌ Con esta configuración no se llega a la meta en {MAX_SOLVER_YEARS} años.")
+        else:
+            st.metric("⏳ Tiempo necesario", f"{int(required_months) // 12} años y {int(required_months) % 12} meses",
+                      delta=f"{required_months / 12 - investment_years:+.1f} años vs. actual", delta_color="inverse")
+    else:
+        required_rate = float(solve_required_rate(target_value, initial_investment, periodic_investment,
+                                                  investment_frequency, investment_years))
+        if np.isnan(required_rate):
+            st.error(f"❌ La meta queda fuera del rango de rendimientos considerado "
+                     f"({RATE_BOUNDS[0]:.0%} a {RATE_BOUNDS[1]:.0%} anual).")
+        else:
+            st.metric("📊 Rendimiento anual necesario", f"{required_rate:.2%}",
+                      delta=f"{(required_rate - annual_return) * 100:+.2f} pp vs. actual", delta_color="inverse")
+            if required_rate > 0.12:
+                st.warning("⚠️ Un rendimiento tan alto es difícil de sostener a largo plazo.")
+
+with tab6:
+    st.subheader("🗓️ Plan de Aportes y Retiros Flexible")
+    st.markdown("Combina aportes periódicos con aumentos anuales, pausas, aportes extraordinarios y retiros. "
+                "Los meses se cuentan desde el inicio (mes 0).")
+
+    default_rules = pd.DataFrame([
+        {"Tipo": "Aporte único", "Desde (mes)": 0, "Hasta (mes)": None, "Monto ($)": initial_investment,
+         "Cada (meses)": None, "Aumento anual (%)": None},
+        {"Tipo": "Aporte periódico", "Desde (mes)": investment_frequency, "Hasta (mes)": investment_years * 12,
+         "Monto ($)": periodic_investment, "Cada (meses)": investment_frequency, "Aumento anual (%)": 3.0},
+        {"Tipo": "Pausa de aportes", "Desde (mes)": 36, "Hasta (mes)": 47, "Monto ($)": None,
+         "Cada (meses)": None, "Aumento anual (%)": None},
+        {"Tipo": "Retiro único", "Desde (mes)": 120, "Hasta (mes)": None, "Monto ($)": 5000.0,
+         "Cada (meses)": None, "Aumento anual (%)": None},
+    ])
+    edited_rules = st.data_editor(
+        default_rules,
+        num_rows="dynamic",
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "Tipo": st.column_config.SelectboxColumn(options=CASH_FLOW_TYPES, required=True),
+            "Desde (mes)": st.column_config.NumberColumn(min_value=0, step=1),
+            "Hasta (mes)": st.column_config.NumberColumn(min_value=0, step=1, help="Vacío = hasta el final"),
+            "Monto ($)": st.column_config.NumberColumn(min_value=0.0, step=10.0),
+            "Cada (meses)": st.column_config.NumberColumn(min_value=1, step=1),
+            "Aumento anual (%)": st.column_config.NumberColumn(step=0.5, help="Aumento del monto por cada año cumplido"),
+        },
+    )
+    timeline = st.radio("Línea temporal", list(TIMELINES), horizontal=True)
+
+    rules = [
+        {
+            "tipo": row["Tipo"],
+            "desde": row["Desde (mes)"] if pd.notna(row["Desde (mes)"]) else 0,
+            "hasta": row["Hasta (mes)"] if pd.notna(row["Hasta (mes)"]) else None,
+            "monto": row["Monto ($)"] if pd.notna(row["Monto ($)"]) else 0.0,
+            "cada": row["Cada (meses)"] if pd.notna(row["Cada (meses)"]) else 1,
+            "aumento": row["Aumento anual (%)"] / 100 if pd.notna(row["Aumento anual (%)"]) else 0.0,
+        }
+        for row in edited_rules.to_dict("records") if row.get("Tipo") in CASH_FLOW_TYPES
+    ]
+    periods_per_year = TIMELINES[timeline]
+    flows = build_cash_flows(rules, investment_years, periods_per_year)
+    plan_values = project_cash_flows(flows, annual_return, periods_per_year)
+    plan_years = np.arange(len(flows)) / periods_per_year
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("💰 Aportes netos", f"${flows.sum():,.0f}")
+    with col2:
+        st.metric("📈 Valor Final", f"${plan_values[-1]:,.0f}")
+    with col3:
+        st.metric("🎯 Ganancia Total", f"${plan_values[-1] - flows.sum():,.0f}")
+
+    depleted = np.flatnonzero((plan_values <= 0) & (np.cumsum(flows) != 0) & (np.arange(len(flows)) > 0))
+    if depleted.size:
+        st.warning(f"⚠️ La cuenta se queda sin fondos en el año {plan_years[depleted[0]]:.1f}.")
+
+    fig_plan = go.Figure()
+    fig_plan.add_trace(go.Scatter(x=plan_years, y=plan_values, mode='lines', name='Valor del Portafolio',
+                                  line=dict(color='#2E86AB', width=3)))
+    fig_plan.add_trace(go.Scatter(x=plan_years, y=np.cumsum(flows), mode='lines', name='Aportes netos acumulados',
+                                  line=dict(color='#A23B72', width=2)))
+    fig_plan.update_layout(title="Evolución del Plan", xaxis_title="Años", yaxis_title="Valor ($)",
+                           hovermode='x unified', height=500)
+    st.plotly_chart(fig_plan, use_container_width=True)
+
+with tab7:
+    st.subheader("🏖️ Fase de Retiro")
+    st.markdown("Simula cuánto dura el portafolio retirando dinero cada mes, con miles de trayectorias de rendimientos.")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        retirement_balance = st.number_input("💰 Saldo al jubilarse ($)", min_value=0.0,
+                                             value=float(round(final_data['Valor_Portafolio'], -3)), step=1000.0)
+        withdrawal_rate = st.slider("📤 Tasa de retiro inicial (%)", min_value=1.0, max_value=10.0, value=4.0, step=0.1,
+                                    help="Porcentaje del saldo inicial retirado el primer año") / 100
+        withdrawal_rule = st.selectbox("📏 Regla de retiro", list(WITHDRAWAL_RULES), format_func=WITHDRAWAL_RULES.get)
+    with col2:
+        retirement_years = st.slider("⏳ Años de retiro", min_value=5, max_value=50, value=30)
+        retirement_return = st.slider("📊 Rendimiento anual en el retiro (%)", min_value=0.0, max_value=15.0,
+                                      value=6.0, step=0.1) / 100
+        retirement_volatility = st.slider("📉 Volatilidad anual en el retiro (%)", min_value=0.0, max_value=40.0,
+                                          value=12.0, step=0.5) / 100
+    with col3:
+        inflation = st.slider("💸 Inflación anual (%)", min_value=0.0, max_value=10.0, value=3.0, step=0.1) / 100
+        retirement_paths = st.select_slider("🔢 Trayectorias", options=[1000, 5000, 10000, 20000, 50000], value=20000,
+                                            key="retirement_paths")
+        success_target = st.slider("✅ Probabilidad de éxito buscada (%)", min_value=50, max_value=99, value=90) / 100
+
+    # El bootstrap histórico se configura en la pestaña Monte Carlo
+    use_history = history is not None and st.checkbox(
+        "📚 Usar el bootstrap histórico de la pestaña Monte Carlo", value=True,
+        help="Las peores secuencias históricas al inicio del retiro son las que más acortan la vida del portafolio"
+    )
+    success_rate, balance_bands, income_bands, swr = retirement_projection(
+        retirement_balance, withdrawal_rate, withdrawal_rule, retirement_return, retirement_volatility,
+        inflation, retirement_years, retirement_paths, 42, success_target,
+        history if use_history else None, block_months, match_return
+    )
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("✅ Probabilidad de éxito", f"{success_rate:.1%}",
+                  help="Trayectorias en las que todos los retiros se pagan completos hasta el final")
+    with col2:
+        if np.isnan(swr):
+            st.metric("🛡️ Tasa de retiro segura", "No aplica",
+                      help="Retirando un porcentaje del saldo la cuenta nunca se agota; revisa cómo varía el ingreso")
+        else:
+            st.metric(f"🛡️ Tasa de retiro segura ({success_target:.0%})", f"{swr:.2%}",
+                      delta=f"{(swr - withdrawal_rate) * 100:+.2f} pp vs. elegida")
+    with col3:
+        st.metric("💵 Retiro del primer año", f"${retirement_balance * withdrawal_rate:,.0f}")
+
+    retirement_axis = np.arange(retirement_years + 1)
+    fig_ret = go.Figure()
+    fig_ret.add_trace(go.Scatter(x=retirement_axis, y=balance_bands['P95'], mode='lines', line=dict(width=0),
+                                 showlegend=False, hoverinfo='skip'))
+    fig_ret.add_trace(go.Scatter(x=retirement_axis, y=balance_bands['P5'], mode='lines', line=dict(width=0),
+                                 fill='tonexty', fillcolor='rgba(46,134,171,0.2)', name='P5 - P95'))
+    fig_ret.add_trace(go.Scatter(x=retirement_axis, y=balance_bands['P50'], mode='lines', name='Mediana',
+                                 line=dict(color='#2E86AB', width=3)))
+    fig_ret.update_layout(title="Saldo durante el Retiro", xaxis_title="Años de retiro", yaxis_title="Saldo ($)",
+                          hovermode='x unified', height=450)
+    st.plotly_chart(fig_ret, use_container_width=True)
+
+    fig_income = go.Figure()
+    for column, color in [('P5', '#A23B72'), ('P50', '#2E86AB'), ('P95', '#4CAF50')]:
+        fig_income.add_trace(go.Scatter(x=retirement_axis[1:], y=income_bands[column], mode='lines', name=column,
+                                        line=dict(color=color, width=2)))
+    fig_income.update_layout(title="Retiro Anual (nominal)", xaxis_title="Años de retiro", yaxis_title="Retiro ($)",
+                             hovermode='x unified', height=400)
+    st.plotly_chart(fig_income, use_container_width=True)
+
 # Footer
 st.markdown("---")
 st.markdown("""
@@ -0,0 +1,103 @@
+# batch.py
+# Recalcula en lote un archivo de escenarios (CSV o Parquet) con el motor de la calculadora,
+# repartiendo los bloques entre todos los núcleos y escribiendo los resultados a medida que llegan.
+#   python batch.py escenarios.csv resultados.parquet --workers 8
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from engine import evaluate_scenarios, SCENARIO_COLUMNS
+
+CHUNK_SIZE = 1000
+OUTPUT_FORMATS = ("csv", "parquet")
+
+
+def read_scenarios(path, chunk_size=CHUNK_SIZE):
+    """Leer los escenarios por bloques; el índice es el número de fila en el archivo"""
+    if path.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        start = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+def evaluate_in_pool(chunks, workers=None):
+    """Evaluar los bloques en un pool de procesos y devolver los resultados en orden.
+
+    Solo hay dos bloques en vuelo por proceso, así la memoria no crece con el tamaño del archivo.
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(evaluate_scenarios, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _write_csv(results, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        for i, chunk in enumerate(results):
+            chunk.to_csv(f, index=False, header=i == 0)
+            yield len(chunk)
+
+
+def _write_parquet(results, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in results:
+            if writer is None:
+                # Los enteros se guardan como float: un bloque posterior puede traer celdas vacías
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                schema = pa.schema([pa.field(f.name, pa.float64()) if pa.types.is_integer(f.type) else f
+                                    for f in schema])
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+            yield len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+_WRITERS = {"csv": _write_csv, "parquet": _write_parquet}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluar en lote escenarios de la calculadora de inversión")
+    parser.add_argument("scenarios", help=f"CSV o Parquet con columnas {', '.join(SCENARIO_COLUMNS)} "
+                                          "(opcionales: annual_volatility, n_paths, seed, goal)")
+    parser.add_argument("output", help="Archivo de resultados (.csv o .parquet)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Formato de salida (por defecto, la extensión)")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto, todos los núcleos)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Escenarios por bloque")
+    args = parser.parse_args()
+
+    fmt = (args.format or args.output.rsplit(".", 1)[-1]).lower()
+    if fmt not in _WRITERS:
+        parser.error(f"Formato de salida no soportado: {fmt}")
+    if not os.path.exists(args.scenarios):
+        parser.error(f"No existe {args.scenarios}")
+
+    start = time.perf_counter()
+    results = evaluate_in_pool(read_scenarios(args.scenarios, args.chunk_size), args.workers)
+    total = sum(_WRITERS[fmt](results, args.output))
+    print(f"✅ {total} escenarios evaluados en {time.perf_counter() - start:.1f} s → {args.output}")
+
+
+if __name__ == "__main__":
+    main()
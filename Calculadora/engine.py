@@ -0,0 +1,557 @@
+# engine.py
+# Motor de cálculo de la calculadora, sin Streamlit: lo usan Calculadora.py (la app) y batch.py (la CLI).
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def contribution_schedule(initial, periodic, frequency, years):
+    """Aporte de cada mes (0..años*12): la inicial en el mes 0 y la periódica cada `frequency` meses"""
+    months = np.arange(years * 12 + 1)
+    contributions = np.where(months % frequency == 0, float(periodic), 0.0)
+    contributions[0] = initial
+    return contributions
+
+
+def project_values(contributions, annual_rates, periods_per_year=12):
+    """Valor del portafolio período a período para una o varias tasas anuales (matriz tasas x períodos).
+
+    El aporte del período se suma antes de aplicar su rendimiento (salvo en el período 0), así que
+    V_m = g^m * Σ_{k<=m} c_k / g^{max(k-1, 0)} con g = (1 + tasa)^(1/períodos): una suma acumulada por fila.
+    """
+    rates = np.atleast_1d(np.asarray(annual_rates, dtype=float))
+    periods = np.arange(len(contributions))
+    growth = (1 + rates[:, None]) ** (1 / periods_per_year)
+    discount = growth ** -np.maximum(periods - 1, 0)
+    return growth ** periods * np.cumsum(contributions * discount, axis=1)
+
+
+def calculate_investment(initial, periodic, frequency, annual_ret, years):
+    contributions = contribution_schedule(initial, periodic, frequency, years)
+    months = np.arange(len(contributions))
+    values = project_values(contributions, annual_ret)[0]
+    invested = np.cumsum(contributions)
+    profit = values - invested
+
+    return pd.DataFrame({
+        'Mes': months,
+        'Año': months // 12,
+        'Inversión_Mensual': contributions,
+        'Inversión_Acumulada': invested,
+        'Valor_Portafolio': values,
+        'Ganancia_Acumulada': profit,
+        'ROI_Porcentaje': np.divide(profit * 100, invested, out=np.zeros_like(profit), where=invested > 0),
+    })
+
+
+def years_to_double(df):
+    """Primer año en que el valor llega al doble del total invertido (None si no llega)"""
+    values = df['Valor_Portafolio'].to_numpy()
+    target = df['Inversión_Acumulada'].iloc[-1] * 2
+    # Con rendimientos positivos el valor nunca baja, así que basta una búsqueda binaria
+    month = np.searchsorted(values, target)
+    return int(df['Año'].iloc[month]) if month < len(values) else None
+
+
+def scenario_final_values(initial, periodic, frequency, annual_rates, years):
+    """Valor final para varias tasas anuales en una sola operación"""
+    return project_values(contribution_schedule(initial, periodic, frequency, years), annual_rates)[:, -1]
+
+
+def sensitivity_grid(initial, periodics, frequency, annual_rates, horizons):
+    """Valores finales para toda la rejilla horizonte x tasa x aporte (difusión de NumPy, sin bucles).
+
+    El valor final es lineal en los aportes: V = inicial * g^M + aporte * g^M * S(M), con
+    S(M) = Σ_{k<=M, k % frecuencia == 0} g^-(k-1). S se acumula una vez hasta el horizonte máximo.
+    """
+    rates = np.asarray(annual_rates, dtype=float)
+    periodics = np.asarray(periodics, dtype=float)
+    horizon_months = np.asarray(horizons, dtype=int) * 12
+    months = np.arange(horizon_months.max() + 1)
+
+    monthly_growth = (1 + rates[:, None]) ** (1 / 12)
+    paid = (months % frequency == 0) & (months > 0)
+    annuity = np.cumsum(paid * monthly_growth ** -np.maximum(months - 1, 0), axis=1)[:, horizon_months].T
+    growth = (monthly_growth[:, 0][None, :] ** horizon_months[:, None])
+    return growth[:, :, None] * (initial + periodics[None, None, :] * annuity[:, :, None])
+
+# ---------- Calendario de flujos arbitrario ----------
+CASH_FLOW_TYPES = ["Aporte periódico", "Aporte único", "Retiro periódico", "Retiro único", "Pausa de aportes"]
+TIMELINES = {"Mensual": 12, "Diaria": 365}
+
+
+def build_cash_flows(rules, years, periods_per_year=12):
+    """Flujo neto de cada período a partir de una lista de reglas (aportes > 0, retiros < 0).
+
+    Cada regla es un dict con tipo, desde/hasta (mes), monto, cada (meses) y aumento (anual, en
+    fracción). Los meses se llevan a la línea temporal elegida (mensual o diaria) y cada regla se
+    aplica de una vez sobre todos sus períodos.
+    """
+    total_periods = int(round(years * periods_per_year))
+    contributions = np.zeros(total_periods + 1)
+    lump_sums = np.zeros(total_periods + 1)
+    paused = np.zeros(total_periods + 1, dtype=bool)
+
+    def to_period(months):
+        return np.minimum(np.rint(np.asarray(months) * periods_per_year / 12).astype(int), total_periods)
+
+    for rule in rules:
+        tipo = rule["tipo"]
+        desde = int(rule.get("desde") or 0)
+        hasta = int(rule.get("hasta") if rule.get("hasta") is not None else years * 12)
+        if desde > years * 12:
+            continue
+        hasta = min(hasta, years * 12)
+        monto = float(rule.get("monto") or 0.0)
+        signo = -1.0 if tipo.startswith("Retiro") else 1.0
+
+        if tipo == "Pausa de aportes":
+            paused[to_period(desde):to_period(hasta) + 1] = True
+        elif tipo.endswith("único"):
+            lump_sums[to_period(desde)] += signo * monto
+        elif hasta >= desde:
+            months = np.arange(desde, hasta + 1, max(int(rule.get("cada") or 1), 1))
+            # Aumento escalonado: el monto sube un `aumento` por cada año cumplido de la regla
+            amounts = monto * (1 + float(rule.get("aumento") or 0.0)) ** ((months - desde) // 12)
+            target = contributions if signo > 0 else lump_sums
+            np.add.at(target, to_period(months), signo * amounts)
+
+    contributions[paused] = 0.0
+    return contributions + lump_sums
+
+
+def project_cash_flows(flows, annual_rate, periods_per_year=12):
+    """Valor del portafolio con un calendario de flujos arbitrario (incluye retiros).
+
+    La proyección es vectorizada; si un retiro deja el saldo en negativo, la cuenta queda en
+    cero hasta el siguiente aporte y desde ahí se vuelve a proyectar (un paso por cada vez que
+    la cuenta se vacía y se vuelve a llenar).
+    """
+    flows = np.asarray(flows, dtype=float)
+    values = project_values(flows, annual_rate, periods_per_year)[0]
+    growth = (1 + annual_rate) ** (1 / periods_per_year)
+    start = 0
+    while True:
+        negative = np.flatnonzero(values[start:] < -1e-9)
+        if negative.size == 0:
+            return values
+        ruin = start + negative[0]
+        refill = np.flatnonzero(flows[ruin + 1:] > 0)
+        if refill.size == 0:
+            values[ruin:] = 0.0
+            return values
+        restart = ruin + 1 + refill[0]
+        values[ruin:restart] = 0.0
+        # Desde el aporte se parte de cero: V_t = (V_{t-1} + c_t) * g
+        tail = flows[restart:]
+        steps = np.arange(1, len(tail) + 1)
+        values[restart:] = growth ** steps * np.cumsum(tail * growth ** -(steps - 1))
+        start = restart
+
+# ---------- Búsqueda de objetivos ----------
+MAX_SOLVER_YEARS = 100
+RATE_BOUNDS = (-0.5, 1.0)   # tasas anuales entre las que se busca el rendimiento necesario
+
+
+def final_value(initial, periodic, frequency, annual_rates, months):
+    """Valor final en forma cerrada (serie geométrica de los aportes); admite arrays que se difunden.
+
+    Con g = (1 + tasa)^(1/12), n = meses // frecuencia aportes y q = g^-frecuencia:
+    V = g^M * (inicial + aporte * S), S = Σ_{j=1..n} g^-(j*frecuencia - 1) = g * q * (1 - q^n) / (1 - q).
+    """
+    g = (1 + np.asarray(annual_rates, dtype=float)) ** (1 / 12)
+    months = np.asarray(months)
+    n = months // frequency
+    q = g ** -frequency
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annuity = np.where(np.isclose(q, 1.0), n, g * q * (1 - q ** n) / (1 - q))
+    return g ** months * (initial + periodic * annuity)
+
+
+def solve_required_contribution(target, initial, frequency, annual_ret, years):
+    """Aporte periódico necesario para llegar a `target` (el valor final es lineal en el aporte)"""
+    months = years * 12
+    base = final_value(initial, 0.0, frequency, annual_ret, months)
+    per_unit = final_value(0.0, 1.0, frequency, annual_ret, months)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        required = (np.asarray(target, dtype=float) - base) / per_unit
+    return np.maximum(required, 0.0)
+
+
+def solve_required_years(target, initial, periodic, frequency, annual_ret, max_years=MAX_SOLVER_YEARS):
+    """Meses necesarios para llegar a `target` (NaN si no se llega en `max_years`).
+
+    Se proyecta todo el calendario una sola vez y se busca con searchsorted sobre la curva.
+    """
+    values = project_values(contribution_schedule(initial, periodic, frequency, max_years), annual_ret)[0]
+    # El valor puede bajar con tasas negativas: se busca sobre su máximo acumulado
+    months = np.searchsorted(np.maximum.accumulate(values), np.asarray(target, dtype=float))
+    return np.where(months < len(values), months, np.nan)
+
+
+def solve_required_rate(target, initial, periodic, frequency, years, bounds=RATE_BOUNDS, iterations=80):
+    """Rendimiento anual necesario para llegar a `target`, por bisección vectorizada.
+
+    `target` puede ser un array: todas las búsquedas avanzan a la vez. NaN si la meta queda
+    fuera del rango de tasas `bounds`.
+    """
+    target = np.asarray(target, dtype=float)
+    months = years * 12
+    lo = np.full(target.shape, bounds[0])
+    hi = np.full(target.shape, bounds[1])
+    reachable = ((final_value(initial, periodic, frequency, lo, months) <= target)
+                 & (final_value(initial, periodic, frequency, hi, months) >= target))
+    for _ in range(iterations):
+        mid = (lo + hi) / 2
+        above = final_value(initial, periodic, frequency, mid, months) >= target
+        hi = np.where(above, mid, hi)
+        lo = np.where(above, lo, mid)
+    return np.where(reachable, (lo + hi) / 2, np.nan)
+
+# ---------- Simulación Monte Carlo ----------
+PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def monthly_log_drift(annual_ret):
+    """Log-rendimiento mensual medio para una tasa anual compuesta (media geométrica).
+
+    Es la convención de todos los simuladores: con esta deriva la trayectoria mediana coincide con
+    la proyección determinista de calculate_investment para la misma tasa.
+    """
+    return np.log1p(annual_ret) / 12
+
+
+def monthly_log_returns(annual_ret, annual_vol, total_months, n_paths, seed=None):
+    """Log-rendimientos mensuales lognormales (caminos x meses) con media geométrica `annual_ret`"""
+    rng = np.random.default_rng(seed)
+    sigma = annual_vol / np.sqrt(12)
+    mu = monthly_log_drift(annual_ret)
+    log_growth = rng.standard_normal((n_paths, total_months))
+    log_growth *= sigma
+    log_growth += mu
+    return log_growth
+
+
+def paths_from_log_returns(contributions, log_growth):
+    """Valor del portafolio en cada mes para cada fila de log-rendimientos (matriz caminos x meses).
+
+    Sigue la misma regla que calculate_investment: el aporte del mes se suma antes de aplicar
+    el rendimiento del mes, salvo en el mes 0.
+    """
+    n_paths, total_months = log_growth.shape
+
+    # G[:, m] = crecimiento acumulado de los meses 1..m, así V_m = G_m * (c_0 + Σ_{1<=k<=m} c_k / G_{k-1})
+    growth = np.empty((n_paths, total_months + 1))
+    growth[:, 0] = 1.0
+    np.cumsum(log_growth, axis=1, out=growth[:, 1:])
+    np.exp(growth[:, 1:], out=growth[:, 1:])
+
+    values = np.empty_like(growth)
+    values[:, 0] = contributions[0]
+    np.divide(contributions[1:], growth[:, :-1], out=values[:, 1:])
+    np.cumsum(values, axis=1, out=values)
+    values *= growth
+    return values
+
+
+def simulate_investment_paths(initial, periodic, frequency, annual_ret, annual_vol, years, n_paths, seed=None):
+    """Trayectorias con rendimientos mensuales lognormales de media geométrica `annual_ret` y volatilidad `annual_vol`"""
+    contributions = contribution_schedule(initial, periodic, frequency, years)
+    log_growth = monthly_log_returns(annual_ret, annual_vol, len(contributions) - 1, n_paths, seed)
+    return paths_from_log_returns(contributions, log_growth)
+
+
+# ---------- Bootstrap histórico ----------
+# CSV local con columnas fecha y rendimiento (rendimiento total mensual en fracción); se genera con
+# download_historical_returns o se sube desde la app.
+HISTORICAL_RETURNS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rendimientos_historicos.csv")
+HISTORICAL_TICKER = "^SP500TR"  # S&P 500 con dividendos; ^GSPC da más historia pero sin dividendos
+DEFAULT_BLOCK_MONTHS = 12
+
+
+def read_historical_returns(source):
+    """Serie de rendimientos mensuales (fracción) indexada por fecha desde un CSV fecha,rendimiento"""
+    data = pd.read_csv(source)
+    returns = pd.Series(pd.to_numeric(data['rendimiento'], errors='coerce').to_numpy(),
+                        index=pd.to_datetime(data['fecha']), name='rendimiento')
+    return returns.dropna().sort_index()
+
+
+def load_historical_returns(path=HISTORICAL_RETURNS_FILE):
+    if not os.path.exists(path):
+        return pd.Series(dtype=float, name='rendimiento')
+    return read_historical_returns(path)
+
+
+def download_historical_returns(ticker=HISTORICAL_TICKER, path=HISTORICAL_RETURNS_FILE, start="1900-01-01"):
+    """Descargar los cierres mensuales de `ticker` y guardar sus rendimientos en el CSV local (requiere yfinance)"""
+    import yfinance as yf
+
+    data = yf.download(ticker, start=start, interval="1mo", auto_adjust=True, progress=False)
+    returns = data['Close'].squeeze().dropna().pct_change().dropna()
+    if len(returns) == 0:
+        # No se pisa un archivo válido con uno vacío si la descarga falla
+        raise ValueError(f"No se recibieron cierres mensuales de {ticker}")
+    pd.DataFrame({'fecha': returns.index.strftime('%Y-%m-%d'), 'rendimiento': returns.to_numpy()}).to_csv(path, index=False)
+    return returns
+
+
+def block_bootstrap_indices(n_history, total_months, n_paths, block_months=DEFAULT_BLOCK_MONTHS, seed=None):
+    """Índices del histórico para cada (camino, mes) de un bootstrap circular por bloques.
+
+    Cada camino encadena bloques de `block_months` meses consecutivos con inicio al azar; el
+    histórico se recorre de forma circular para que todos los meses tengan la misma probabilidad.
+    Solo se sortean los inicios: el resto es una suma con los desplazamientos 0..bloque-1.
+    """
+    rng = np.random.default_rng(seed)
+    n_blocks = -(-total_months // block_months)
+    starts = rng.integers(0, n_history, size=(n_paths, n_blocks, 1), dtype=np.int32)
+    indices = (starts + np.arange(block_months, dtype=np.int32)).reshape(n_paths, -1)[:, :total_months]
+    indices %= n_history
+    return indices
+
+
+def bootstrap_log_returns(history, total_months, n_paths, block_months=DEFAULT_BLOCK_MONTHS, seed=None,
+                          annual_ret=None):
+    """Log-rendimientos mensuales (caminos x meses) remuestreados por bloques de rendimientos históricos.
+
+    Con `annual_ret` el histórico se desplaza a la misma deriva que el modelo lognormal
+    (monthly_log_drift), así la tasa significa lo mismo en ambos modos; se conservan la
+    volatilidad, las colas y las rachas de meses buenos y malos.
+    """
+    log_history = np.log1p(np.asarray(history, dtype=float))
+    if annual_ret is not None:
+        log_history = log_history - log_history.mean() + monthly_log_drift(annual_ret)
+    return log_history[block_bootstrap_indices(len(log_history), total_months, n_paths, block_months, seed)]
+
+
+def bootstrap_investment_paths(initial, periodic, frequency, history, years, n_paths, block_months=DEFAULT_BLOCK_MONTHS,
+                               seed=None, annual_ret=None):
+    """Trayectorias con bloques de rendimientos históricos reales en lugar de rendimientos lognormales"""
+    contributions = contribution_schedule(initial, periodic, frequency, years)
+    log_growth = bootstrap_log_returns(history, len(contributions) - 1, n_paths, block_months, seed, annual_ret)
+    return paths_from_log_returns(contributions, log_growth)
+
+
+def historical_summary(history):
+    """Rendimiento anual compuesto, volatilidad anual y peor racha de 12 meses del histórico"""
+    log_history = np.log1p(np.asarray(history, dtype=float))
+    rolling = np.convolve(log_history, np.ones(12), mode='valid') if len(log_history) >= 12 else log_history
+    return {
+        'rendimiento': float(np.expm1(log_history.mean() * 12)),
+        'volatilidad': float(np.std(history, ddof=1) * np.sqrt(12)),
+        'peor_12m': float(np.expm1(rolling.min())),
+    }
+
+
+def monte_carlo_projection(initial, periodic, frequency, annual_ret, annual_vol, years, n_paths, seed, goal,
+                           history=None, block_months=DEFAULT_BLOCK_MONTHS, match_return=False):
+    """Bandas de percentiles por mes, valores finales y probabilidad de alcanzar `goal`.
+
+    Sin `history` los rendimientos son lognormales; con `history` se remuestrean bloques del histórico.
+    """
+    if history is None:
+        values = simulate_investment_paths(initial, periodic, frequency, annual_ret, annual_vol, years, n_paths, seed)
+    else:
+        values = bootstrap_investment_paths(initial, periodic, frequency, history, years, n_paths, block_months, seed,
+                                            annual_ret if match_return else None)
+    bands = pd.DataFrame(np.percentile(values, PERCENTILES, axis=0).T, columns=[f"P{p}" for p in PERCENTILES])
+    bands.insert(0, 'Mes', np.arange(values.shape[1]))
+    bands['Inversión_Acumulada'] = np.cumsum(contribution_schedule(initial, periodic, frequency, years))
+    final_values = values[:, -1]
+    return bands, final_values, float((final_values >= goal).mean())
+
+# ---------- Fase de retiro ----------
+WITHDRAWAL_RULES = {
+    "FIJO_REAL": "Monto fijo ajustado por inflación",
+    "PORCENTAJE": "Porcentaje del saldo",
+    "GUARDARRAILES": "Guardarraíles (±20%, ajustes del 10%)",
+}
+GUARDRAIL_BAND = 0.20   # margen sobre la tasa inicial antes de recortar o subir el retiro
+GUARDRAIL_STEP = 0.10   # tamaño del recorte / aumento
+SWR_BOUNDS = (0.0, 0.20)
+
+
+def withdrawal_factors(log_growth):
+    """Factores por año para la fase de retiro (caminos x años x 12).
+
+    H[..., k] es el crecimiento acumulado del año hasta el mes k y D[..., k] = Σ_{j<=k} 1 / H[..., j-1].
+    Con un retiro mensual W fijo durante el año, el saldo tras el mes k es H_k * (B - W * D_k), y
+    los meses 0..k se pagan completos si B >= W * D_k.
+    """
+    n_paths, total_months = log_growth.shape
+    H = np.exp(np.cumsum(log_growth.reshape(n_paths, total_months // 12, 12), axis=2))
+    D = np.ones_like(H)
+    np.divide(1.0, H[:, :, :-1], out=D[:, :, 1:])
+    np.cumsum(D, axis=2, out=D)
+    return H, D
+
+
+def simulate_withdrawals(balance, withdrawal_rate, rule, log_growth, inflation, keep_paths=True, factors=None):
+    """Simular la fase de retiro sobre todos los caminos a la vez, un paso vectorizado por año.
+
+    Al inicio de cada mes se retira la doceava parte del retiro anual vigente y después se aplica
+    el rendimiento del mes. El retiro anual se ajusta por inflación cada 12 meses; con
+    guardarraíles además se recorta o sube si la tasa actual se aleja de la inicial. Como el
+    retiro no cambia dentro del año, cada año se resuelve en forma cerrada con withdrawal_factors.
+    Devuelve (éxito por camino, saldo al final de cada año caminos x años+1, retiro de cada año
+    caminos x años); sin `keep_paths` solo se calcula el éxito.
+    """
+    H, D = factors if factors is not None else withdrawal_factors(log_growth)
+    n_paths, years, _ = H.shape
+    # Crecimiento y factor de retiro del año completo, contiguos por año para el bucle
+    H_year = np.ascontiguousarray(H[:, :, -1].T)
+    D_year = np.ascontiguousarray(D[:, :, -1].T)
+    saldo = np.full(n_paths, float(balance))
+    anual = np.full(n_paths, balance * withdrawal_rate)
+    exito = np.ones(n_paths, dtype=bool)
+    saldos = retiros = None
+    if keep_paths:
+        saldos = np.empty((years + 1, n_paths))
+        saldos[0] = balance
+        retiros = np.empty((years, n_paths))
+
+    if rule == "PORCENTAJE":
+        # Se retira una fracción fija del saldo: decae geométricamente y nunca se agota.
+        # Retiro del año = saldo inicial * tasa/12 * Σ_k keep^k * H_{k-1}
+        keep = (1 - withdrawal_rate / 12) ** np.arange(13)
+        income_factor = (1 + H[:, :, :-1] @ keep[1:12]).T * withdrawal_rate / 12
+        for year in range(years):
+            if keep_paths:
+                retiros[year] = saldo * income_factor[year]
+            saldo = saldo * keep[12] * H_year[year]
+            if keep_paths:
+                saldos[year + 1] = saldo
+        return exito, (saldos.T if keep_paths else None), (retiros.T if keep_paths else None)
+
+    for year in range(years):
+        if year > 0:
+            anual *= 1 + inflation
+            if rule == "GUARDARRAILES":
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    tasa_actual = anual / saldo
+                anual = np.where(tasa_actual > withdrawal_rate * (1 + GUARDRAIL_BAND), anual * (1 - GUARDRAIL_STEP),
+                                 np.where(tasa_actual < withdrawal_rate * (1 - GUARDRAIL_BAND), anual * (1 + GUARDRAIL_STEP),
+                                          anual))
+        mensual = anual / 12
+        pagado_completo = saldo >= mensual * D_year[year] * (1 - 1e-12)
+        if keep_paths:
+            retiros[year] = np.where(pagado_completo, anual, 0.0)
+            # Caminos que se quedan sin fondos este año: se paga mes a mes hasta vaciar la cuenta
+            agotados = np.flatnonzero(~pagado_completo & (saldo > 0))
+            if agotados.size:
+                Hy, Dy, W = H[agotados, year], D[agotados, year], mensual[agotados, None]
+                restante = saldo[agotados, None] - W * Dy
+                H_prev = np.concatenate([np.ones((agotados.size, 1)), Hy[:, :-1]], axis=1)
+                retiros[year, agotados] = np.clip(H_prev * restante + W, 0.0, W).sum(axis=1)
+        exito &= pagado_completo
+        saldo = np.where(pagado_completo, H_year[year] * (saldo - mensual * D_year[year]), 0.0)
+        if keep_paths:
+            saldos[year + 1] = saldo
+
+    return exito, (saldos.T if keep_paths else None), (retiros.T if keep_paths else None)
+
+
+def max_fixed_real_rates(log_growth, inflation):
+    """Tasa de retiro fija (real) máxima que aguanta cada camino, en forma cerrada.
+
+    Sin tope en cero el saldo es B_m = G_m * (B_0 - Σ_{j<=m} W_j / G_{j-1}); todos los retiros se
+    pagan si Σ_{j<=M} W_j / G_{j-1} <= B_0, y como W_j = W * inflación acumulada del año de j,
+    la tasa anual máxima es 12 / Σ_j infl_j / G_{j-1}.
+    """
+    n_paths, total_months = log_growth.shape
+    entry = np.zeros((n_paths, total_months))
+    np.cumsum(log_growth[:, :-1], axis=1, out=entry[:, 1:])
+    indexation = (1 + inflation) ** (np.arange(total_months) // 12)
+    return 12 / (indexation * np.exp(-entry)).sum(axis=1)
+
+
+def safe_withdrawal_rate(rule, log_growth, inflation, success=0.9, bounds=SWR_BOUNDS, iterations=20, factors=None):
+    """Mayor tasa de retiro inicial con probabilidad de éxito >= `success` sobre los mismos caminos.
+
+    Con monto fijo real es un cuantil de la tasa máxima de cada camino; con guardarraíles se busca
+    por bisección. Con porcentaje del saldo la cuenta nunca se agota, así que no aplica (NaN).
+    """
+    if rule == "FIJO_REAL":
+        return float(np.quantile(max_fixed_real_rates(log_growth, inflation), 1 - success))
+    if rule == "PORCENTAJE":
+        return float("nan")
+    factors = factors if factors is not None else withdrawal_factors(log_growth)
+    lo, hi = bounds
+    for _ in range(iterations):
+        mid = (lo + hi) / 2
+        exito, _, _ = simulate_withdrawals(1.0, mid, rule, log_growth, inflation, keep_paths=False, factors=factors)
+        if exito.mean() >= success:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def retirement_projection(balance, withdrawal_rate, rule, annual_ret, annual_vol, inflation, years, n_paths, seed,
+                          success_target, history=None, block_months=DEFAULT_BLOCK_MONTHS, match_return=False):
+    """Probabilidad de éxito, bandas de saldo y retiro por año y tasa de retiro segura.
+
+    Con `history` los rendimientos se remuestrean por bloques del histórico en lugar de ser lognormales.
+    """
+    if history is None:
+        log_growth = monthly_log_returns(annual_ret, annual_vol, years * 12, n_paths, seed)
+    else:
+        log_growth = bootstrap_log_returns(history, years * 12, n_paths, block_months, seed,
+                                           annual_ret if match_return else None)
+    factors = withdrawal_factors(log_growth)
+    exito, saldos, retiros = simulate_withdrawals(balance, withdrawal_rate, rule, log_growth, inflation, factors=factors)
+    balance_bands = pd.DataFrame(np.percentile(saldos, PERCENTILES, axis=0).T,
+                                 columns=[f"P{p}" for p in PERCENTILES])
+    income_bands = pd.DataFrame(np.percentile(retiros, PERCENTILES, axis=0).T,
+                                columns=[f"P{p}" for p in PERCENTILES])
+    swr = safe_withdrawal_rate(rule, log_growth, inflation, success_target, factors=factors)
+    return float(exito.mean()), balance_bands, income_bands, swr
+
+
+# ---------- Evaluación de escenarios en lote ----------
+SCENARIO_COLUMNS = ['initial', 'periodic', 'frequency', 'annual_return', 'years']
+SCENARIO_DEFAULTS = {'annual_volatility': 0.0, 'n_paths': 0, 'seed': None, 'goal': np.nan}
+RESULT_COLUMNS = ['Inversión_Acumulada', 'Valor_Portafolio', 'Ganancia_Acumulada', 'ROI_Porcentaje',
+                  'P5', 'P50', 'P95', 'Prob_Meta']
+
+
+def evaluate_scenarios(scenarios):
+    """Resultados de un bloque de escenarios (una fila por escenario, columnas SCENARIO_COLUMNS).
+
+    La proyección determinista se calcula en forma cerrada para todas las filas a la vez. Las filas
+    con `annual_volatility` y `n_paths` > 0 añaden percentiles del valor final y la probabilidad de
+    llegar a `goal` con trayectorias Monte Carlo (semilla `seed`, o el número de fila si falta).
+    """
+    missing = [c for c in SCENARIO_COLUMNS if c not in scenarios.columns]
+    if missing:
+        raise ValueError(f"Faltan columnas en los escenarios: {', '.join(missing)}")
+    scenarios = scenarios.assign(**{c: v for c, v in SCENARIO_DEFAULTS.items() if c not in scenarios.columns})
+
+    initial = scenarios['initial'].to_numpy(dtype=float)
+    periodic = scenarios['periodic'].to_numpy(dtype=float)
+    frequency = scenarios['frequency'].to_numpy(dtype=int)
+    months = scenarios['years'].to_numpy(dtype=int) * 12
+    values = final_value(initial, periodic, frequency, scenarios['annual_return'].to_numpy(dtype=float), months)
+    invested = initial + periodic * (months // frequency)
+    profit = values - invested
+
+    results = pd.DataFrame({
+        'Inversión_Acumulada': invested,
+        'Valor_Portafolio': values,
+        'Ganancia_Acumulada': profit,
+        'ROI_Porcentaje': np.divide(profit * 100, invested, out=np.zeros_like(profit), where=invested > 0),
+    }, index=scenarios.index)
+    results[['P5', 'P50', 'P95', 'Prob_Meta']] = np.nan
+
+    stochastic = (scenarios['annual_volatility'].fillna(0) > 0) & (scenarios['n_paths'].fillna(0) > 0)
+    for row in scenarios[stochastic].itertuples():
+        seed = int(row.Index) if pd.isna(row.seed) else int(row.seed)
+        final_values = simulate_investment_paths(row.initial, row.periodic, int(row.frequency), row.annual_return,
+                                                 row.annual_volatility, int(row.years), int(row.n_paths), seed)[:, -1]
+        results.loc[row.Index, ['P5', 'P50', 'P95']] = np.percentile(final_values, [5, 50, 95])
+        if not pd.isna(row.goal):
+            results.loc[row.Index, 'Prob_Meta'] = (final_values >= row.goal).mean()
+
+    return pd.concat([scenarios, results], axis=1)
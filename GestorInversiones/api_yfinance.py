@@ -1,9 +1,383 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import pandas as pd
 import yfinance as yf
 
-def get_current_price(ticker):
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# ---------- CONFIG CACHE DE COTIZACIONES ----------
+# Caché compartida por todo el proceso: ticker -> (precio, momento de la descarga)
+QUOTE_CACHE_TTL = 60          # segundos que una cotización se considera fresca
+QUOTE_CACHE_MAX_SIZE = 500    # máximo de tickers guardados (se descarta el menos usado)
+QUOTE_MISS_TTL = 300          # segundos sin volver a pedir un ticker que no devolvió precio
+
+_quote_cache = OrderedDict()
+_quote_misses = {}  # ticker -> momento del último intento sin precio (caché negativa)
+_cache_lock = threading.Lock()
+_refreshing = set()
+
+# Copia en disco de las últimas cotizaciones para arrancar sin red tras un reinicio
+QUOTES_DB = "quotes.db"
+_disk_loaded = False
+
+
+def _connect_quotes_db():
+    conn = sqlite3.connect(QUOTES_DB, timeout=5)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS quotes ("
+        "ticker TEXT PRIMARY KEY, precio REAL NOT NULL, fetched_at REAL NOT NULL)"
+    )
+    return conn
+
+
+def _load_disk_quotes():
+    # Se ejecuta una sola vez por proceso con el lock tomado. Las entradas llegan con su
+    # fecha original, así que las vencidas se sirven al instante y se renuevan en segundo plano.
+    global _disk_loaded
+    if _disk_loaded:
+        return
+    _disk_loaded = True
     try:
-        stock = yf.Ticker(ticker)
-        price = stock.history(period="1d")['Close'].iloc[-1]
-        return round(price, 2)
+        with _connect_quotes_db() as conn:
+            rows = conn.execute(
+                "SELECT ticker, precio, fetched_at FROM quotes ORDER BY fetched_at DESC LIMIT ?",
+                (QUOTE_CACHE_MAX_SIZE,)
+            ).fetchall()
+    except sqlite3.Error:
+        return
+    for ticker, price, fetched_at in reversed(rows):
+        _quote_cache.setdefault(ticker, (price, fetched_at))
+
+
+def _save_disk_quotes(prices, fetched_at):
+    try:
+        with _connect_quotes_db() as conn:
+            conn.executemany(
+                "INSERT INTO quotes (ticker, precio, fetched_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(ticker) DO UPDATE SET precio = excluded.precio, fetched_at = excluded.fetched_at",
+                [(ticker, price, fetched_at) for ticker, price in prices.items()]
+            )
+    except sqlite3.Error:
+        pass
+
+
+def configure_quote_cache(ttl=None, max_size=None):
+    global QUOTE_CACHE_TTL, QUOTE_CACHE_MAX_SIZE
+    with _cache_lock:
+        if ttl is not None:
+            QUOTE_CACHE_TTL = ttl
+        if max_size is not None:
+            QUOTE_CACHE_MAX_SIZE = max_size
+            while len(_quote_cache) > QUOTE_CACHE_MAX_SIZE:
+                _quote_cache.popitem(last=False)
+
+
+def clear_quote_cache():
+    with _cache_lock:
+        _quote_cache.clear()
+        _quote_misses.clear()
+
+
+def _store_quotes(prices):
+    if not prices:
+        return
+    now = time.time()
+    with _cache_lock:
+        for ticker, price in prices.items():
+            _quote_cache[ticker] = (price, now)
+            _quote_cache.move_to_end(ticker)
+            _quote_misses.pop(ticker, None)
+        while len(_quote_cache) > QUOTE_CACHE_MAX_SIZE:
+            _quote_cache.popitem(last=False)
+    _save_disk_quotes(prices, now)
+
+
+# ---------- DESCARGA CONCURRENTE (fallback) ----------
+# Para los tickers que la descarga en bloque no resuelve se consulta uno por uno
+# en un pool acotado, respetando el límite de peticiones de Yahoo.
+QUOTE_WORKERS = 8       # hilos máximos consultando a la vez
+QUOTE_TIMEOUT = 10      # segundos por petición
+QUOTE_RETRIES = 2       # reintentos por ticker tras el primer fallo
+
+_yahoo_bucket = TokenBucket(rate=5, capacity=10)
+
+# Error de yfinance para un ticker que responde pero sin precios (no existe o no cotiza)
+try:
+    from yfinance.exceptions import YFPricesMissingError as _NoPriceData
+except ImportError:  # versiones de yfinance sin excepciones propias
+    _NoPriceData = ()
+
+
+def _fetch_single_price(ticker):
+    for attempt in range(QUOTE_RETRIES + 1):
+        if not _yahoo_bucket.acquire(timeout=QUOTE_TIMEOUT):
+            continue
+        try:
+            # raise_errors: sin él yfinance se traga los fallos de red y devuelve un frame vacío,
+            # que no se distingue de un ticker sin datos y cortaría los reintentos
+            history = yf.Ticker(ticker).history(period="5d", timeout=QUOTE_TIMEOUT, raise_errors=True)
+            close = history['Close'].dropna()
+            if not close.empty:
+                return round(float(close.iloc[-1]), 2)
+            break  # Respuesta vacía: el ticker no existe o no cotiza, no tiene sentido reintentar
+        except _NoPriceData as e:
+            logger.debug("Sin precios para %s: %s", ticker, e)
+            break
+        except Exception as e:
+            logger.debug("Intento %d fallido para %s: %s", attempt + 1, ticker, e)
+            time.sleep(0.5 * 2 ** attempt)
+    logger.warning("No se pudo obtener el precio de %s", ticker)
+    return None
+
+
+def _fetch_prices_concurrently(tickers):
+    if not tickers:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(QUOTE_WORKERS, len(tickers))) as pool:
+        results = pool.map(_fetch_single_price, tickers)
+    return {ticker: price for ticker, price in zip(tickers, results) if price is not None}
+
+
+def _download_prices(tickers):
+    prices = {}
+    try:
+        # period="5d" para tener un cierre válido aunque algún mercado no haya abierto hoy
+        data = yf.download(tickers, period="5d", auto_adjust=True, progress=False, threads=True,
+                           timeout=QUOTE_TIMEOUT)
+        close = data['Close']
+        if isinstance(close, pd.Series):
+            close = close.to_frame(name=tickers[0])
+        last = close.ffill().iloc[-1]
+        for ticker, price in last.items():
+            if pd.notna(price):
+                prices[ticker] = round(float(price), 2)
     except Exception as e:
-        return 0.0
\ No newline at end of file
+        logger.warning("Falló la descarga en bloque de %d tickers: %s", len(tickers), e)
+
+    pending = [ticker for ticker in tickers if ticker not in prices]
+    prices.update(_fetch_prices_concurrently(pending))
+    return prices
+
+
+def _refresh_in_background(tickers):
+    def worker():
+        try:
+            _store_quotes(_download_prices(tickers))
+        finally:
+            with _cache_lock:
+                _refreshing.difference_update(tickers)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+
+def get_current_prices(tickers):
+    """Obtener el último precio de varios tickers con una sola descarga en bloque"""
+    tickers = sorted({t for t in tickers if isinstance(t, str) and t})
+    if not tickers:
+        return {}
+
+    prices = {}
+    missing = []
+    stale = []
+    now = time.time()
+    with _cache_lock:
+        _load_disk_quotes()
+        for ticker in tickers:
+            entry = _quote_cache.get(ticker)
+            if entry is None:
+                # Un ticker que acaba de fallar no vuelve a bloquear la página hasta que venza QUOTE_MISS_TTL
+                if now - _quote_misses.get(ticker, float("-inf")) >= QUOTE_MISS_TTL:
+                    missing.append(ticker)
+                continue
+            prices[ticker] = entry[0]
+            _quote_cache.move_to_end(ticker)
+            if now - entry[1] > QUOTE_CACHE_TTL and ticker not in _refreshing:
+                stale.append(ticker)
+        _refreshing.update(stale)
+
+    # Las cotizaciones vencidas se sirven tal cual y se renuevan en segundo plano
+    if stale:
+        _refresh_in_background(stale)
+
+    # Solo se bloquea la página por los tickers que nunca se han descargado
+    if missing:
+        fetched = _download_prices(missing)
+        _store_quotes(fetched)
+        # Los que fallaron no se devuelven: quedan sin precio en vez de valer 0, y se anotan como fallidos
+        failed_at = time.time()
+        with _cache_lock:
+            for ticker in missing:
+                if ticker not in fetched:
+                    _quote_misses[ticker] = failed_at
+        prices.update(fetched)
+    return prices
+
+
+def map_current_prices(tickers):
+    """Precio actual para cada fila de una serie de tickers (un solo fetch por ticker único)"""
+    prices = get_current_prices(tickers.dropna().unique())
+    return pd.Series(tickers.astype(object).map(prices), index=tickers.index, dtype=float)
+
+
+# ---------- HISTÓRICO OHLCV ----------
+# Un archivo Parquet por ticker con las velas diarias y, en quotes.db, desde qué fecha se
+# pidió y qué día se descargó por última vez. Solo se descarga lo que falta: el tramo anterior
+# al inicio guardado y la cola desde la última vela (que se vuelve a pedir por si era parcial).
+HISTORY_DIR = "price_history"
+HISTORY_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+_history_lock = threading.Lock()
+
+
+def _history_path(ticker):
+    return os.path.join(HISTORY_DIR, quote(ticker, safe="") + ".parquet")
+
+
+def _empty_history():
+    return pd.DataFrame(columns=HISTORY_COLUMNS, index=pd.DatetimeIndex([], name="Date"), dtype=float)
+
+
+def _connect_history_meta():
+    conn = sqlite3.connect(QUOTES_DB, timeout=5)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS history_meta ("
+        "ticker TEXT PRIMARY KEY, desde TEXT NOT NULL, actualizado TEXT NOT NULL)"
+    )
+    return conn
+
+
+def _load_history_meta(tickers):
+    try:
+        with _connect_history_meta() as conn:
+            rows = conn.execute(
+                f"SELECT ticker, desde, actualizado FROM history_meta WHERE ticker IN ({','.join('?' * len(tickers))})",
+                tickers
+            ).fetchall()
+    except sqlite3.Error:
+        return {}
+    return {ticker: (pd.Timestamp(desde), pd.Timestamp(actualizado)) for ticker, desde, actualizado in rows}
+
+
+def _save_history_meta(meta):
+    try:
+        with _connect_history_meta() as conn:
+            conn.executemany(
+                "INSERT INTO history_meta (ticker, desde, actualizado) VALUES (?, ?, ?) "
+                "ON CONFLICT(ticker) DO UPDATE SET desde = excluded.desde, actualizado = excluded.actualizado",
+                [(ticker, str(desde.date()), str(actualizado.date())) for ticker, (desde, actualizado) in meta.items()]
+            )
+    except sqlite3.Error:
+        pass
+
+
+def _read_history(ticker):
+    """Velas guardadas del ticker, o None si no hay archivo"""
+    try:
+        return pd.read_parquet(_history_path(ticker))
+    except Exception:
+        return None
+
+
+def _write_history(ticker, history):
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    path = _history_path(ticker)
+    history.to_parquet(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def _download_history(tickers, start, end=None):
+    """Velas diarias de [start, end) para varios tickers en una sola descarga: ticker -> DataFrame"""
+    data = yf.download(tickers, start=start, end=end, auto_adjust=False, progress=False, threads=True,
+                       timeout=QUOTE_TIMEOUT)
+    if data is None or data.empty:
+        return {}
+    data.index = pd.DatetimeIndex(data.index).tz_localize(None).normalize().rename("Date")
+    result = {}
+    for ticker in tickers:
+        if isinstance(data.columns, pd.MultiIndex):
+            if ticker not in data.columns.get_level_values(1):
+                continue
+            frame = data.xs(ticker, axis=1, level=1)
+        else:
+            frame = data
+        frame = frame.reindex(columns=HISTORY_COLUMNS).astype(float).dropna(subset=["Close"])
+        if not frame.empty:
+            result[ticker] = frame
+    return result
+
+
+def get_history(tickers, start):
+    """Velas diarias (OHLCV) desde `start` de cada ticker, servidas desde el disco: ticker -> DataFrame"""
+    tickers = sorted({t for t in tickers if isinstance(t, str) and t})
+    start = pd.Timestamp(start).normalize()
+    today = pd.Timestamp.today().normalize()
+    if not tickers:
+        return {}
+
+    with _history_lock:
+        meta = _load_history_meta(tickers)
+        histories = {}
+        sin_archivo = set()
+        # Tramos pendientes agrupados por (inicio, fin) para descargar cada grupo en bloque
+        pending = {}
+        for ticker in tickers:
+            history = _read_history(ticker) if ticker in meta else None
+            if history is None:
+                histories[ticker] = _empty_history()
+                sin_archivo.add(ticker)
+                pending.setdefault((start, None), []).append(ticker)
+                continue
+            histories[ticker] = history
+            desde, actualizado = meta[ticker]
+            if start < desde:
+                pending.setdefault((start, desde), []).append(ticker)
+            if actualizado < today:
+                tail = history.index.max() if not history.empty else desde
+                pending.setdefault((tail, None), []).append(ticker)
+
+        updated = set()
+        for (range_start, range_end), group in pending.items():
+            try:
+                fetched = _download_history(group, range_start, range_end)
+            except Exception as e:
+                logger.warning("No se pudo descargar el histórico de %s: %s", ", ".join(group), e)
+                continue
+            for ticker in group:
+                frame = fetched.get(ticker)
+                if frame is not None:
+                    merged = pd.concat([histories[ticker], frame])
+                    histories[ticker] = merged[~merged.index.duplicated(keep="last")].sort_index()
+                # Aunque el ticker no devuelva datos se anota la consulta para no repetirla hoy
+                desde, actualizado = meta.get(ticker, (range_start, today))
+                if ticker in sin_archivo or range_end is not None:
+                    desde = range_start
+                if range_end is None:
+                    actualizado = today
+                meta[ticker] = (desde, actualizado)
+                updated.add(ticker)
+
+        for ticker in updated:
+            _write_history(ticker, histories[ticker])
+        _save_history_meta({ticker: meta[ticker] for ticker in updated})
+
+    return {ticker: history.loc[start:] for ticker, history in histories.items()}
+
+
+def get_close_history(tickers, start):
+    """Cierres diarios desde `start` (índice fecha, una columna por ticker)"""
+    tickers = sorted({t for t in tickers if isinstance(t, str) and t})
+    histories = get_history(tickers, start)
+    if not histories:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="Date"), columns=tickers, dtype=float)
+    closes = pd.DataFrame({ticker: histories[ticker]["Close"] for ticker in tickers})
+    closes.index.name = "Date"
+    return closes.sort_index()
@@ -1,19 +1,429 @@
-import pandas as pd
+import json
+import logging
 import os
+import sqlite3
+import threading
+import uuid
+
+import pandas as pd
+
+from positions import LEDGER_FORMAT
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS_CSV = "operations.csv"  # formato de importación/exportación
+
+# Backend de almacenamiento: "parquet" (snapshot Parquet + diario) o "sqlite"
+STORAGE_BACKEND = os.environ.get("GESTOR_STORAGE", "parquet")
+
+# Parquet: snapshot columnar con tipos fijos + diario de solo-anexar. Cada línea del diario es
+# un lote {"add": [...], "del": [...]} escrito de una vez; la compactación lo vuelca al Parquet.
+OPERATIONS_PARQUET = "operations.parquet"
+OPERATIONS_JOURNAL = "operations.journal"
+COMPACT_EVERY = 500  # líneas de diario antes de compactar
+
+# SQLite: tabla indexada por (ticker, tipo, fecha) en modo WAL
+OPERATIONS_DB = "operations.db"
+
+# "lotes": en una venta, ids de los lotes de compra a consumir (separados por coma); vacío = método por defecto
+# "formato": versión de las reglas con que se escribió la operación; vacío = ledger anterior a los lotes
+OPERATION_COLUMNS = ["id", "fecha", "ticker", "cantidad", "precio", "tipo", "comision", "lotes", "formato"]
+_PLACEHOLDERS = ", ".join("?" * len(OPERATION_COLUMNS))
+
+
+def new_operation_id():
+    return uuid.uuid4().hex
+
+
+def _typed(df):
+    df = df.reindex(columns=OPERATION_COLUMNS)
+    ids = df["id"].astype(object)
+    missing_ids = ids.isna()
+    if missing_ids.any():
+        ids[missing_ids] = [new_operation_id() for _ in range(missing_ids.sum())]
+    return pd.DataFrame({
+        "id": ids.astype(str),
+        "fecha": pd.to_datetime(df["fecha"]),
+        "ticker": df["ticker"].astype(str).astype("category"),
+        "cantidad": pd.to_numeric(df["cantidad"], errors="coerce").astype("float64"),
+        "precio": pd.to_numeric(df["precio"], errors="coerce").astype("float64"),
+        "tipo": df["tipo"].astype(str).astype("category"),
+        "comision": pd.to_numeric(df["comision"], errors="coerce").fillna(0.0).astype("float64"),
+        "lotes": df["lotes"].astype(object).where(df["lotes"].notna() & (df["lotes"] != ""), None),
+        "formato": pd.to_numeric(df["formato"], errors="coerce").astype("Int64"),
+    }).reset_index(drop=True)
+
+
+def _append_rows(df, records):
+    """Añadir filas nuevas a un ledger ya tipado convirtiendo solo las nuevas"""
+    new_rows = _typed(pd.DataFrame(records))
+    for col in ("ticker", "tipo"):
+        valores = new_rows[col].astype(str)
+        nuevas = pd.Index(valores.unique()).difference(df[col].cat.categories)
+        if len(nuevas):
+            df = df.assign(**{col: df[col].cat.add_categories(nuevas)})
+        new_rows[col] = valores.astype(df[col].dtype)
+    return pd.concat([df, new_rows], ignore_index=True)
+
+
+def _apply_changes(df, ids, added, deleted):
+    """Aplicar altas y bajas a `df` en O(filas nuevas); `ids` (los ids de `df`) se actualiza en el sitio.
+
+    Reaplicar un lote ya compactado no duplica filas: las altas con un id existente se ignoran.
+    """
+    nuevas = {}
+    for record in added:
+        if record["id"] not in ids:
+            nuevas[record["id"]] = record
+    if nuevas:
+        df = _append_rows(df, list(nuevas.values()))
+        ids.update(nuevas)
+    borrar = ids.intersection(deleted)
+    if borrar:
+        df = df[~df["id"].isin(borrar)].reset_index(drop=True)
+        ids.difference_update(borrar)
+    return df
+
+
+def _empty_operations():
+    return _typed(pd.DataFrame(columns=OPERATION_COLUMNS))
+
+
+def _filter(df, ticker=None, tipo=None):
+    if ticker is not None:
+        df = df[df["ticker"] == ticker]
+    if tipo is not None:
+        df = df[df["tipo"] == tipo]
+    return df
+
+
+def _serialize(operation):
+    record = {col: operation.get(col) for col in OPERATION_COLUMNS}
+    record["id"] = record["id"] or new_operation_id()
+    record["fecha"] = str(pd.Timestamp(record["fecha"]).date())
+    record["ticker"] = str(record["ticker"])
+    record["tipo"] = str(record["tipo"])
+    for col in ("cantidad", "precio", "comision"):
+        record[col] = float(record[col] or 0.0)
+    record["lotes"] = str(record["lotes"]) if record["lotes"] and not pd.isna(record["lotes"]) else None
+    record["formato"] = int(record["formato"]) if record["formato"] is not None and not pd.isna(record["formato"]) else None
+    return record
+
+
+# ---------- Backend Parquet + diario ----------
+class ParquetJournalStore:
+    def __init__(self, parquet_path=OPERATIONS_PARQUET, journal_path=OPERATIONS_JOURNAL,
+                 compact_every=COMPACT_EVERY):
+        self.parquet_path = parquet_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        # Estado del último ledger leído, para aplicar solo lo nuevo del diario en cada rerun
+        self._state = {"snapshot": None, "offset": 0, "lines": 0, "df": None, "ids": set()}
+        # Los reruns de Streamlit comparten este objeto desde varios hilos: anexar, releer el
+        # diario y compactar se hacen de a uno
+        self._lock = threading.RLock()
+
+    def _fsync_dir(self):
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(os.path.dirname(os.path.abspath(self.parquet_path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _write_snapshot(self, df):
+        tmp_path = self.parquet_path + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.parquet_path)
+        self._fsync_dir()
+
+    def _snapshot_key(self):
+        if not os.path.exists(self.parquet_path):
+            return None
+        stat = os.stat(self.parquet_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.parquet_path):
+            if os.path.exists(OPERATIONS_CSV):
+                self.replace_all(pd.read_csv(OPERATIONS_CSV))
+            else:
+                return _empty_operations()
+        df = pd.read_parquet(self.parquet_path, memory_map=True)
+        if list(df.columns) != OPERATION_COLUMNS:
+            # Ledger anterior al diario o a una columna nueva: se le asignan ids persistentes y se
+            # completa el esquema una sola vez
+            df = _typed(df)
+            self._write_snapshot(df)
+        return df
+
+    def _reload(self):
+        df = self._read_snapshot()
+        self._state.update(df=df, ids=set(df["id"]), snapshot=self._snapshot_key(), offset=0, lines=0)
+
+    def _replay_journal(self, df, offset):
+        """Aplicar las líneas del diario desde `offset`. Devuelve (df, nuevo offset, líneas leídas)."""
+        if not os.path.exists(self.journal_path):
+            return df, 0, 0
+        added, deleted = [], set()
+        lines = 0
+        with open(self.journal_path, "rb") as f:
+            f.seek(offset)
+            for raw in iter(f.readline, b""):
+                if not raw.endswith(b"\n"):
+                    # Línea a medio escribir (o cola de un corte): no se avanza; record_changes la
+                    # descarta antes de anexar
+                    break
+                try:
+                    batch = json.loads(raw)
+                except ValueError:
+                    logger.warning("Línea ilegible en %s (byte %d): se ignora", self.journal_path, offset)
+                    batch = {}
+                added.extend(batch.get("add") or [])
+                deleted.update(batch.get("del") or [])
+                offset += len(raw)
+                lines += 1
+        # Todas las líneas nuevas se aplican de una vez (los ids son únicos, el orden no importa)
+        return _apply_changes(df, self._state["ids"], added, deleted), offset, lines
+
+    def load(self, ticker=None, tipo=None):
+        with self._lock:
+            state = self._state
+            if state["df"] is None or state["snapshot"] != self._snapshot_key():
+                self._reload()
+
+            journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+            if journal_size != state["offset"]:
+                if journal_size < state["offset"]:
+                    # El diario fue compactado por otro proceso
+                    self._reload()
+                df, offset, lines = self._replay_journal(state["df"], state["offset"])
+                state.update(df=df, offset=offset, lines=state["lines"] + lines)
+            return _filter(state["df"], ticker, tipo)
+
+    def record_changes(self, added=(), deleted=()):
+        batch = {"add": [_serialize(op) for op in added], "del": [str(op_id) for op_id in deleted]}
+        line = (json.dumps(batch) + "\n").encode("utf-8")
+        with self._lock:
+            self.load()
+            if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > self._state["offset"]:
+                # Cola rota de una escritura interrumpida por un corte: se descarta antes de anexar
+                with open(self.journal_path, "rb+") as f:
+                    f.truncate(self._state["offset"])
+            with open(self.journal_path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.load()
+            if self._state["lines"] >= self.compact_every:
+                self.compact()
+            return self.load()
+
+    def compact(self):
+        """Volcar el diario en el snapshot Parquet y vaciarlo"""
+        with self._lock:
+            df = self.load()
+            self._write_snapshot(df)
+            # Si el proceso muere aquí, el diario se reaplica sobre el snapshot nuevo sin efectos (ids idempotentes)
+            with open(self.journal_path, "wb") as f:
+                os.fsync(f.fileno())
+            self._state.update(df=df, snapshot=self._snapshot_key(), offset=0, lines=0)
+
+    def replace_all(self, operations):
+        df = _typed(operations)
+        with self._lock:
+            self._write_snapshot(df)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._state.update(df=None, ids=set(), snapshot=None, offset=0, lines=0)
+        return df
+
+
+# ---------- Backend SQLite ----------
+class SQLiteStore:
+    def __init__(self, db_path=OPERATIONS_DB):
+        self.db_path = db_path
+        self._cache = {"key": None, "df": None, "ids": set()}
+        self._lock = threading.RLock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS operations (
+                    id TEXT PRIMARY KEY,
+                    fecha TEXT NOT NULL,
+                    ticker TEXT NOT NULL,
+                    cantidad REAL NOT NULL,
+                    precio REAL NOT NULL,
+                    tipo TEXT NOT NULL,
+                    comision REAL NOT NULL DEFAULT 0,
+                    lotes TEXT,
+                    formato INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS idx_operations_ticker_tipo_fecha
+                    ON operations (ticker, tipo, fecha);
+                CREATE TABLE IF NOT EXISTS operations_backup (
+                    backup TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    fecha TEXT NOT NULL,
+                    ticker TEXT NOT NULL,
+                    cantidad REAL NOT NULL,
+                    precio REAL NOT NULL,
+                    tipo TEXT NOT NULL,
+                    comision REAL NOT NULL DEFAULT 0,
+                    lotes TEXT,
+                    formato INTEGER,
+                    PRIMARY KEY (backup, id)
+                );
+            """)
+            for table in ("operations", "operations_backup"):
+                columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                for column, decl in (("lotes", "TEXT"), ("formato", "INTEGER")):
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _cache_key(self):
+        # En modo WAL los commits modifican el archivo -wal antes que la base principal
+        key = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                key.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(key)
+
+    def load(self, ticker=None, tipo=None):
+        if ticker is None and tipo is None:
+            with self._lock:
+                key = self._cache_key()
+                if self._cache["key"] != key:
+                    with self._connect() as conn:
+                        df = _typed(pd.read_sql_query(f"SELECT {', '.join(OPERATION_COLUMNS)} FROM operations", conn))
+                    self._cache.update(key=key, df=df, ids=set(df["id"]))
+                return self._cache["df"]
+
+        # Consultas por ticker/tipo: búsqueda por índice en vez de recorrer todo el ledger
+        conditions, params = [], []
+        if ticker is not None:
+            conditions.append("ticker = ?")
+            params.append(ticker)
+        if tipo is not None:
+            conditions.append("tipo = ?")
+            params.append(tipo)
+        query = (f"SELECT {', '.join(OPERATION_COLUMNS)} FROM operations "
+                 f"WHERE {' AND '.join(conditions)} ORDER BY fecha")
+        with self._connect() as conn:
+            return _typed(pd.read_sql_query(query, conn, params=params))
+
+    def record_changes(self, added=(), deleted=()):
+        records = [_serialize(op) for op in added]
+        deleted = [str(i) for i in deleted]
+        with self._lock:
+            # Si la caché refleja la base, el lote se aplica también sobre ella en vez de releer la tabla
+            fresh = self._cache["df"] is not None and self._cache["key"] == self._cache_key()
+            with self._connect() as conn:  # una sola transacción para todo el lote
+                # Mismas reglas que el diario Parquet: un id existente no se sobrescribe
+                if records:
+                    conn.executemany(
+                        f"INSERT OR IGNORE INTO operations ({', '.join(OPERATION_COLUMNS)}) VALUES ({_PLACEHOLDERS})",
+                        [tuple(r[col] for col in OPERATION_COLUMNS) for r in records]
+                    )
+                if deleted:
+                    conn.executemany("DELETE FROM operations WHERE id = ?", [(i,) for i in deleted])
+            if fresh:
+                df = _apply_changes(self._cache["df"], self._cache["ids"], records, deleted)
+                self._cache.update(key=self._cache_key(), df=df)
+            return self.load()
+
+    def compact(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def replace_all(self, operations):
+        df = _typed(operations)
+        records = [_serialize(row) for row in df.to_dict("records")]
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM operations")
+                conn.executemany(
+                    f"INSERT INTO operations ({', '.join(OPERATION_COLUMNS)}) VALUES ({_PLACEHOLDERS})",
+                    [tuple(r[col] for col in OPERATION_COLUMNS) for r in records]
+                )
+            self._cache.update(key=None, df=None, ids=set())
+        return df
+
+    def import_backup(self, name, operations):
+        """Guardar un backup CSV como instantánea con nombre, separada del ledger activo"""
+        records = [_serialize(row) for row in _typed(operations).to_dict("records")]
+        with self._connect() as conn:
+            conn.execute("DELETE FROM operations_backup WHERE backup = ?", (name,))
+            conn.executemany(
+                f"INSERT INTO operations_backup (backup, {', '.join(OPERATION_COLUMNS)}) "
+                f"VALUES (?, {_PLACEHOLDERS})",
+                [(name, *(r[col] for col in OPERATION_COLUMNS)) for r in records]
+            )
+        return len(records)
+
+
+STORAGE_BACKENDS = {
+    "parquet": ParquetJournalStore,
+    "sqlite": SQLiteStore,
+}
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        if STORAGE_BACKEND not in STORAGE_BACKENDS:
+            raise ValueError(f"Backend de almacenamiento desconocido: {STORAGE_BACKEND}")
+        _store = STORAGE_BACKENDS[STORAGE_BACKEND]()
+    return _store
+
+
+# ---------- API pública ----------
+def load_operations(ticker=None, tipo=None):
+    return get_store().load(ticker=ticker, tipo=tipo)
+
+
+def record_changes(added=(), deleted=()):
+    """Registrar un lote de altas y bajas de forma atómica"""
+    return get_store().record_changes(added=added, deleted=deleted)
 
-OPERATIONS_CSV = "operations.csv"
 
 def save_operation(operation):
-    new_operation = pd.DataFrame([operation])
-    if not os.path.exists(OPERATIONS_CSV):
-        new_operation.to_csv(OPERATIONS_CSV, index=False)
-    else:
-        new_operation.to_csv(OPERATIONS_CSV, mode='a', header=False, index=False)
+    """Registrar una operación nueva, marcada con el formato actual del ledger"""
+    return record_changes(added=[{**operation, "formato": LEDGER_FORMAT}])
+
+
+def delete_operation(operation_id):
+    return record_changes(deleted=[operation_id])
+
+
+def compact_operations():
+    get_store().compact()
+
+
+def save_operations(operations):
+    """Reescribir el ledger completo"""
+    return get_store().replace_all(operations)
+
+
+def import_operations_csv(path=OPERATIONS_CSV):
+    """Importar un CSV con el formato antiguo como ledger activo"""
+    return save_operations(pd.read_csv(path))
+
 
-def load_operations():
-    if os.path.exists(OPERATIONS_CSV):
-        return pd.read_csv(OPERATIONS_CSV)
-    return pd.DataFrame(columns=["fecha", "ticker", "cantidad", "precio", "tipo", "comision"])
+def export_operations_csv(path=OPERATIONS_CSV):
+    load_operations().drop(columns=["id"]).to_csv(path, index=False, date_format="%Y-%m-%d")
+    return path
 
 
 '''def save_cash_transaction(transaction):
@@ -41,4 +451,4 @@ def apply_inactivity_fee():
             }
             save_cash_transaction(fee_transaction)
             return True
-    return False'''
\ No newline at end of file
+    return False'''
@@ -0,0 +1,292 @@
+# fundamentals.py
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import requests
+import yfinance as yf
+
+from rate_limit import TokenBucket
+
+HTTP_TIMEOUT = 10  # segundos por petición
+
+# Límites por proveedor compartidos por todos los hilos: fetch_fundamentals_many abre un pool por
+# ticker dentro del pool de tickers, y sin ellos podrían salir 8 x 4 peticiones al mismo proveedor.
+PROVIDER_CONCURRENCY = {"FMP": 4, "Alpha Vantage": 2, "Polygon": 2}  # peticiones simultáneas
+
+_provider_slots = {name: threading.BoundedSemaphore(n) for name, n in PROVIDER_CONCURRENCY.items()}
+_provider_buckets = {
+    "FMP": TokenBucket(rate=5, capacity=5),
+    "Alpha Vantage": TokenBucket(rate=5 / 60, capacity=5),  # plan gratuito: 5 peticiones por minuto
+    "Polygon": TokenBucket(rate=5 / 60, capacity=5),        # plan gratuito: 5 peticiones por minuto
+}
+
+FUNDAMENTAL_FIELDS = [
+    'Margen Neto (%)',
+    'ROIC (%)',
+    'Crecimiento EPS 5Y (%)',
+    'Crecimiento Ganancias LT (%)',
+    'P/E Ratio',
+    'P/B Ratio',
+    'Ratio Liquidez Inmediata',
+    'Ratio Deuda/Patrimonio',
+    'Rentabilidad Dividendo (%)',
+    'Ratio Reparto Dividendos (%)',
+]
+
+# Umbrales (bueno, malo) de cada indicador, compartidos por las tarjetas y el screener
+INDICATOR_THRESHOLDS = {
+    'Margen Neto (%)': dict(threshold_good=10, threshold_bad=0, higher_is_better=True),
+    'ROIC (%)': dict(threshold_good=20, threshold_bad=5, higher_is_better=True),
+    'Crecimiento EPS 5Y (%)': dict(threshold_good=10, threshold_bad=0, higher_is_better=True),
+    'Crecimiento Ganancias LT (%)': dict(threshold_good=8, threshold_bad=0, higher_is_better=True),
+    'P/E Ratio': dict(threshold_good=15, threshold_bad=30, higher_is_better=False),
+    'P/B Ratio': dict(threshold_good=2, threshold_bad=5, higher_is_better=False),
+    'Ratio Liquidez Inmediata': dict(threshold_good=1, threshold_bad=0.5, higher_is_better=True),
+    'Ratio Deuda/Patrimonio': dict(threshold_good=0.5, threshold_bad=1, higher_is_better=False),
+    'Rentabilidad Dividendo (%)': dict(threshold_good=3, threshold_bad=0, higher_is_better=True),
+    'Ratio Reparto Dividendos (%)': dict(threshold_good=30, threshold_bad=70, higher_is_better=False),
+}
+
+
+def _missing_fields(fundamentals):
+    return [k for k in FUNDAMENTAL_FIELDS if fundamentals.get(k) is None]
+
+
+def _to_float(value):
+    if value in (None, '', 'None', '-'):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# ---------- yfinance (fuente principal) ----------
+def _from_yfinance(ticker, info):
+    # ROIC aproximado: ROE * (1 - Deuda/Capital total)
+    roic = None
+    roe = info.get('returnOnEquity')
+    debt_to_equity = info.get('debtToEquity')
+    if roe and debt_to_equity:
+        total_capital_ratio = 1 / (1 + (debt_to_equity / 100))
+        roic = roe * total_capital_ratio * 100
+
+    # earningsQuarterlyGrowth como proxy del crecimiento de ganancias a largo plazo
+    quarterly_growth = info.get('earningsQuarterlyGrowth')
+    earnings_growth_lt = quarterly_growth * 100 if quarterly_growth else None
+
+    return {
+        'Ticker': ticker,
+        'Name': info.get('longName', info.get('shortName', ticker)),
+        'Margen Neto (%)': info.get('profitMargins') * 100 if info.get('profitMargins') else None,
+        'ROIC (%)': roic,
+        'Crecimiento EPS 5Y (%)': info.get('earningsGrowth') * 100 if info.get('earningsGrowth') else None,
+        'Crecimiento Ganancias LT (%)': earnings_growth_lt,
+        'P/E Ratio': info.get('trailingPE', None),
+        'P/B Ratio': info.get('priceToBook', None),
+        'Ratio Liquidez Inmediata': info.get('quickRatio', None),
+        'Ratio Deuda/Patrimonio': info.get('debtToEquity') / 100 if info.get('debtToEquity') else None,
+        'Rentabilidad Dividendo (%)': info.get('dividendYield') if info.get('dividendYield') else None,
+        'Ratio Reparto Dividendos (%)': info.get('payoutRatio') * 100 if info.get('payoutRatio') else None
+    }
+
+
+# ---------- Proveedores de respaldo ----------
+# Cada uno devuelve solo los campos que pudo calcular; la fusión decide cuáles se usan.
+def _fmp_ratios(ticker, api_key):
+    url = f"https://financialmodelingprep.com/api/v3/ratios/{ticker}?apikey={api_key}"
+    response = requests.get(url, timeout=HTTP_TIMEOUT).json()
+    if not response:
+        return {}
+    data = response[0]  # Datos más recientes
+    fields = {
+        'ROIC (%)': data.get('returnOnCapitalEmployed') * 100 if data.get('returnOnCapitalEmployed') else None,
+        'Margen Neto (%)': data.get('netProfitMargin') * 100 if data.get('netProfitMargin') else None,
+        'P/E Ratio': data.get('priceEarningsRatio') or None,
+        'P/B Ratio': data.get('priceToBookRatio') or None,
+        'Ratio Liquidez Inmediata': data.get('quickRatio') or None,
+        'Ratio Deuda/Patrimonio': data.get('debtEquityRatio') or None,
+    }
+    return {k: v for k, v in fields.items() if v is not None}
+
+
+def _fmp_growth(ticker, api_key):
+    url = f"https://financialmodelingprep.com/api/v3/financial-growth/{ticker}?apikey={api_key}"
+    response = requests.get(url, timeout=HTTP_TIMEOUT).json()
+    if not response:
+        return {}
+    data = response[0]
+    fields = {
+        'Crecimiento EPS 5Y (%)': data.get('fiveYEarRevenueGrowthPerShare') * 100 if data.get('fiveYEarRevenueGrowthPerShare') else None,
+        'Crecimiento Ganancias LT (%)': data.get('revenueGrowth') * 100 if data.get('revenueGrowth') else None,
+    }
+    return {k: v for k, v in fields.items() if v is not None}
+
+
+def _alpha_overview(ticker, api_key):
+    url = f"https://www.alphavantage.co/query?function=OVERVIEW&symbol={ticker}&apikey={api_key}"
+    response = requests.get(url, timeout=HTTP_TIMEOUT).json()
+    if 'Symbol' not in response:
+        return {}
+
+    fields = {}
+    profit_margin = _to_float(response.get('ProfitMargin'))
+    if profit_margin:
+        fields['Margen Neto (%)'] = profit_margin * 100
+    pe_ratio = _to_float(response.get('PERatio'))
+    if pe_ratio:
+        fields['P/E Ratio'] = pe_ratio
+    pb_ratio = _to_float(response.get('PriceToBookRatio'))
+    if pb_ratio:
+        fields['P/B Ratio'] = pb_ratio
+
+    # ROIC con datos de Alpha Vantage
+    roe_av = _to_float(response.get('ReturnOnEquityTTM'))
+    debt_equity_av = _to_float(response.get('DebtToEquityRatio'))
+    if roe_av and debt_equity_av:
+        fields['ROIC (%)'] = roe_av * (1 / (1 + debt_equity_av))
+
+    # Aproximación muy básica del crecimiento basada en el precio objetivo de los analistas
+    target_val = _to_float(response.get('AnalystTargetPrice'))
+    current_val = _to_float(response.get('Price'))
+    if target_val and current_val:
+        implied_growth = ((target_val / current_val) - 1) * 100
+        if -50 <= implied_growth <= 100:  # Filtrar valores extremos
+            fields['Crecimiento Ganancias LT (%)'] = implied_growth
+    return fields
+
+
+def _polygon_financials(ticker, api_key):
+    url = "https://api.polygon.io/vX/reference/financials"
+    params = {"ticker": ticker, "timeframe": "annual", "limit": 1, "apiKey": api_key}
+    response = requests.get(url, params=params, timeout=HTTP_TIMEOUT).json()
+    results = response.get('results') or []
+    if not results:
+        return {}
+    # Estados financieros del último ejercicio: cada partida es {"value": ..., "unit": ...}
+    financials = results[0].get('financials') or {}
+    income = financials.get('income_statement') or {}
+    balance = financials.get('balance_sheet') or {}
+
+    def value(statement, name):
+        return _to_float((statement.get(name) or {}).get('value'))
+
+    revenues = value(income, 'revenues')
+    net_income = value(income, 'net_income_loss')
+    equity = value(balance, 'equity')
+    liabilities = value(balance, 'liabilities')
+    long_term_debt = value(balance, 'long_term_debt')
+    current_assets = value(balance, 'current_assets')
+    current_liabilities = value(balance, 'current_liabilities')
+    inventory = value(balance, 'inventory') or 0.0
+
+    fields = {}
+    if net_income is not None and revenues:
+        fields['Margen Neto (%)'] = net_income / revenues * 100
+    # ROIC aproximado: beneficio neto / (patrimonio + deuda a largo plazo)
+    if net_income is not None and equity and long_term_debt is not None and equity + long_term_debt > 0:
+        fields['ROIC (%)'] = net_income / (equity + long_term_debt) * 100
+    if current_assets is not None and current_liabilities:
+        fields['Ratio Liquidez Inmediata'] = (current_assets - inventory) / current_liabilities
+    if liabilities is not None and equity and equity > 0:
+        fields['Ratio Deuda/Patrimonio'] = liabilities / equity
+    return fields
+
+
+def _limited(name, fetch, ticker, key):
+    """Llamar a un proveedor respetando su concurrencia y su ritmo de peticiones"""
+    with _provider_slots[name]:
+        if not _provider_buckets[name].acquire(timeout=HTTP_TIMEOUT):
+            raise TimeoutError(f"Límite de peticiones de {name} alcanzado")
+        return fetch(ticker, key)
+
+
+# ---------- Pipeline ----------
+def fetch_fundamentals(ticker, fmp_key=None, alpha_key=None, polygon_key=None, info=None):
+    """Datos fundamentales de yfinance completados en paralelo con FMP, Alpha Vantage y Polygon.
+
+    Devuelve (fundamentals, avisos). `info` permite reutilizar un payload de yfinance ya descargado.
+    """
+    if info is None:
+        info = yf.Ticker(ticker).info
+    fundamentals = _from_yfinance(ticker, info)
+
+    avisos = []
+    # Solo se recurre a los respaldos si faltan más de 2 indicadores
+    if len(_missing_fields(fundamentals)) <= 2:
+        return fundamentals, avisos
+
+    # Orden = prioridad: si dos proveedores dan el mismo campo gana el primero de la lista
+    providers = []
+    if fmp_key and fmp_key != "demo":
+        providers += [("FMP", _fmp_ratios, fmp_key), ("FMP", _fmp_growth, fmp_key)]
+    if alpha_key:
+        providers.append(("Alpha Vantage", _alpha_overview, alpha_key))
+    if polygon_key and polygon_key != "demo":
+        providers.append(("Polygon", _polygon_financials, polygon_key))
+    if not providers:
+        return fundamentals, avisos
+
+    # Todas las peticiones salen a la vez: la latencia es la del proveedor más lento
+    # y no la suma de los timeouts. Los campos se fusionan a medida que llegan.
+    source_priority = {k: -1 for k in FUNDAMENTAL_FIELDS if fundamentals[k] is not None}
+    with ThreadPoolExecutor(max_workers=len(providers)) as pool:
+        futures = {
+            pool.submit(_limited, name, fetch, ticker, key): (priority, name)
+            for priority, (name, fetch, key) in enumerate(providers)
+        }
+        for future in as_completed(futures):
+            priority, name = futures[future]
+            try:
+                fields = future.result()
+            except Exception:
+                aviso = f"⚠️ {name} no disponible para {ticker}"
+                if aviso not in avisos:
+                    avisos.append(aviso)
+                continue
+            for field, value in fields.items():
+                if source_priority.get(field, len(providers)) > priority:
+                    fundamentals[field] = value
+                    source_priority[field] = priority
+
+    return fundamentals, avisos
+
+
+def fetch_fundamentals_many(tickers, fmp_key=None, alpha_key=None, polygon_key=None, max_workers=8):
+    """Ejecutar fetch_fundamentals para muchos tickers a la vez. Devuelve (DataFrame, avisos)."""
+    tickers = list(dict.fromkeys(tickers))
+    rows = []
+    avisos = []
+    if not tickers:
+        return pd.DataFrame(columns=['Ticker', 'Name'] + FUNDAMENTAL_FIELDS), avisos
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tickers))) as pool:
+        futures = {pool.submit(fetch_fundamentals, t, fmp_key, alpha_key, polygon_key): t for t in tickers}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                fundamentals, ticker_avisos = future.result()
+            except Exception as e:
+                avisos.append(f"❌ Error al obtener datos para {ticker}: {str(e)}")
+                continue
+            rows.append(fundamentals)
+            avisos.extend(ticker_avisos)
+
+    df = pd.DataFrame(rows, columns=['Ticker', 'Name'] + FUNDAMENTAL_FIELDS)
+    df[FUNDAMENTAL_FIELDS] = df[FUNDAMENTAL_FIELDS].apply(pd.to_numeric, errors='coerce')
+    return df.sort_values('Ticker').reset_index(drop=True), avisos
+
+
+def classify_fundamentals(df):
+    """Clasificar cada indicador como 'Excelente', 'Aceptable', 'Preocupante' o 'N/A' en bloque"""
+    status = pd.DataFrame(index=df.index)
+    for field, t in INDICATOR_THRESHOLDS.items():
+        values = df[field].to_numpy(dtype=float)
+        if t['higher_is_better']:
+            good, bad = values >= t['threshold_good'], values <= t['threshold_bad']
+        else:
+            good, bad = values <= t['threshold_good'], values >= t['threshold_bad']
+        status[field] = np.select([np.isnan(values), good, bad], ['N/A', 'Excelente', 'Preocupante'], 'Aceptable')
+    return status
@@ -1,85 +1,220 @@
 # indicadores.py
+import asyncio
 import os
-import requests
+import sqlite3
+import time
+
+import httpx
 import pandas as pd
 
 # ---------- CONFIG CACHE ----------
-CACHE_FILE = "indicadores_cache.csv"
+# Una fila por (ticker, indicador) con su propia fecha de descarga: un upsert por campo
+# y caducidad independiente para cada proveedor.
+CACHE_DB = "indicadores_cache.db"
+CACHE_TTL = 24 * 3600  # segundos que un indicador se considera vigente
+LEGACY_CACHE_FILE = "indicadores_cache.csv"
 
-def load_cache():
-    if os.path.exists(CACHE_FILE):
-        return pd.read_csv(CACHE_FILE, index_col="ticker")
-    else:
-        return pd.DataFrame()
 
-def save_cache(ticker, data):
-    df_cache = load_cache()
-    new_data = pd.DataFrame([data], index=[ticker])
-    df_cache.update(new_data)
-    df_cache = pd.concat([df_cache, new_data[~new_data.index.isin(df_cache.index)]])
-    df_cache.to_csv(CACHE_FILE)
+def _connect_cache():
+    conn = sqlite3.connect(CACHE_DB, timeout=5)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS indicadores ("
+        "ticker TEXT NOT NULL, campo TEXT NOT NULL, valor, fetched_at REAL NOT NULL, "
+        "PRIMARY KEY (ticker, campo))"
+    )
+    return conn
 
-# ---------- API FMP ----------
-def get_fmp_indicators(ticker, fmp_key):
-    base_url = "https://financialmodelingprep.com/api/v3"
-    result = {}
 
+def _import_legacy_cache(conn):
+    # Migra una sola vez la caché CSV antigua, fechada con la última modificación del archivo
+    if not os.path.exists(LEGACY_CACHE_FILE):
+        return
+    if conn.execute("SELECT 1 FROM indicadores LIMIT 1").fetchone():
+        return
     try:
-        ratios_url = f"{base_url}/ratios-ttm/{ticker}?apikey={fmp_key}"
-        r = requests.get(ratios_url)
-        data = r.json()
-        if data:
-            result["Net Profit Margin"] = data[0].get("netProfitMarginTTM", "N/D")
-            result["ROIC"] = data[0].get("returnOnInvestedCapitalTTM", "N/D")
-            result["Quick Ratio"] = data[0].get("quickRatioTTM", "N/D")
-            result["Debt to Equity"] = data[0].get("debtEquityRatioTTM", "N/D")
-
-        dividends_url = f"{base_url}/key-metrics-ttm/{ticker}?apikey={fmp_key}"
-        r = requests.get(dividends_url)
-        data = r.json()
-        if data:
-            result["Payout Ratio"] = data[0].get("payoutRatioTTM", "N/D")
-    except:
-        pass
+        legacy = pd.read_csv(LEGACY_CACHE_FILE, index_col=0)
+    except (ValueError, pd.errors.ParserError):
+        return
+    fetched_at = os.path.getmtime(LEGACY_CACHE_FILE)
+    conn.executemany(
+        "INSERT OR IGNORE INTO indicadores (ticker, campo, valor, fetched_at) VALUES (?, ?, ?, ?)",
+        [(str(ticker).upper(), campo, None if pd.isna(valor) else valor, fetched_at)
+         for ticker, row in legacy.iterrows() for campo, valor in row.items()]
+    )
+
+
+def load_cache(tickers, ttl=None):
+    """Indicadores vigentes en caché: {ticker: {campo: valor}} (los caducados se omiten)"""
+    tickers = list(tickers)
+    if not tickers:
+        return {}
+    min_fetched_at = time.time() - (CACHE_TTL if ttl is None else ttl)
+    placeholders = ",".join("?" * len(tickers))
+    with _connect_cache() as conn:
+        _import_legacy_cache(conn)
+        rows = conn.execute(
+            f"SELECT ticker, campo, valor FROM indicadores "
+            f"WHERE ticker IN ({placeholders}) AND fetched_at >= ?",
+            (*tickers, min_fetched_at)
+        ).fetchall()
+    cache = {}
+    for ticker, campo, valor in rows:
+        cache.setdefault(ticker, {})[campo] = valor
+    return cache
+
+
+def save_cache(results):
+    """Guardar {ticker: {campo: valor}} en una sola transacción (upsert por campo)"""
+    now = time.time()
+    rows = [(ticker, campo, valor, now) for ticker, data in results.items() for campo, valor in data.items()]
+    if not rows:
+        return
+    with _connect_cache() as conn:
+        conn.executemany(
+            "INSERT INTO indicadores (ticker, campo, valor, fetched_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(ticker, campo) DO UPDATE SET valor = excluded.valor, fetched_at = excluded.fetched_at",
+            rows
+        )
+
+
+def invalidate_cache(ticker=None):
+    with _connect_cache() as conn:
+        if ticker is None:
+            conn.execute("DELETE FROM indicadores")
+        else:
+            conn.execute("DELETE FROM indicadores WHERE ticker = ?", (ticker.upper(),))
+
 
+# ---------- CONFIG HTTP ----------
+HTTP_TIMEOUT = 10  # segundos por petición
+# Peticiones simultáneas máximas por proveedor (los planes gratuitos limitan la concurrencia)
+PROVIDER_CONCURRENCY = {"fmp": 5, "alpha": 2}
+FMP_BASE_URL = "https://financialmodelingprep.com/api/v3"
+ALPHA_URL = "https://www.alphavantage.co/query"
+
+DEFAULT_INDICATORS = {
+    "Net Profit Margin": "N/D",
+    "ROIC": "N/D",
+    "P/E Ratio": "N/D",
+    "P/B Ratio": "N/D",
+    "Quick Ratio": "N/D",
+    "Debt to Equity": "N/D",
+    "Dividend Yield": "N/D",
+    "Payout Ratio": "N/D"
+}
+
+# Campos que aporta cada proveedor: solo se consulta el proveedor con algún campo caducado
+PROVIDER_FIELDS = {
+    "fmp": ["Net Profit Margin", "ROIC", "Quick Ratio", "Debt to Equity", "Payout Ratio"],
+    "alpha": ["P/E Ratio", "P/B Ratio", "Dividend Yield"],
+}
+
+
+async def _get_json(client, semaphore, url, params):
+    async with semaphore:
+        try:
+            r = await client.get(url, params=params)
+            return r.json()
+        except (httpx.HTTPError, ValueError):
+            return None
+
+
+# ---------- API FMP ----------
+async def _fmp_indicators_async(client, semaphore, ticker, fmp_key):
+    params = {"apikey": fmp_key}
+    ratios, metrics = await asyncio.gather(
+        _get_json(client, semaphore, f"{FMP_BASE_URL}/ratios-ttm/{ticker}", params),
+        _get_json(client, semaphore, f"{FMP_BASE_URL}/key-metrics-ttm/{ticker}", params),
+    )
+    result = {}
+    if ratios and isinstance(ratios, list):
+        result["Net Profit Margin"] = ratios[0].get("netProfitMarginTTM", "N/D")
+        result["ROIC"] = ratios[0].get("returnOnInvestedCapitalTTM", "N/D")
+        result["Quick Ratio"] = ratios[0].get("quickRatioTTM", "N/D")
+        result["Debt to Equity"] = ratios[0].get("debtEquityRatioTTM", "N/D")
+    if metrics and isinstance(metrics, list):
+        result["Payout Ratio"] = metrics[0].get("payoutRatioTTM", "N/D")
     return result
 
+
 # ---------- API Alpha Vantage ----------
-def get_alpha_indicators(ticker, alpha_key):
-    url = f"https://www.alphavantage.co/query?function=OVERVIEW&symbol={ticker}&apikey={alpha_key}"
+async def _alpha_indicators_async(client, semaphore, ticker, alpha_key):
+    params = {"function": "OVERVIEW", "symbol": ticker, "apikey": alpha_key}
+    data = await _get_json(client, semaphore, ALPHA_URL, params)
     result = {}
-    try:
-        r = requests.get(url)
-        data = r.json()
-        if "Symbol" in data:
-            result["P/E Ratio"] = data.get("PERatio", "N/D")
-            result["P/B Ratio"] = data.get("PriceToBookRatio", "N/D")
-            result["Dividend Yield"] = data.get("DividendYield", "N/D")
-    except:
-        pass
+    if isinstance(data, dict) and "Symbol" in data:
+        result["P/E Ratio"] = data.get("PERatio", "N/D")
+        result["P/B Ratio"] = data.get("PriceToBookRatio", "N/D")
+        result["Dividend Yield"] = data.get("DividendYield", "N/D")
     return result
 
+
+# ---------- Capa asíncrona: todos los proveedores para todos los tickers a la vez ----------
+def _new_client():
+    limits = httpx.Limits(max_connections=sum(PROVIDER_CONCURRENCY.values()),
+                          max_keepalive_connections=sum(PROVIDER_CONCURRENCY.values()))
+    return httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=limits)
+
+
+async def _fetch_indicators_async(pending, alpha_key, fmp_key):
+    """pending: {ticker: proveedores a consultar}. Devuelve solo los campos recibidos."""
+    semaphores = {name: asyncio.Semaphore(n) for name, n in PROVIDER_CONCURRENCY.items()}
+    fetchers = {"fmp": (_fmp_indicators_async, fmp_key), "alpha": (_alpha_indicators_async, alpha_key)}
+
+    async def one(client, ticker, providers):
+        parts = await asyncio.gather(*(
+            fetchers[p][0](client, semaphores[p], ticker, fetchers[p][1]) for p in providers
+        ))
+        data = {}
+        for part in parts:
+            data.update(part)
+        return data
+
+    async with _new_client() as client:
+        results = await asyncio.gather(*(one(client, t, providers) for t, providers in pending.items()))
+    return dict(zip(pending, results))
+
+
+async def _single_provider(fetch, ticker, key, provider):
+    async with _new_client() as client:
+        return await fetch(client, asyncio.Semaphore(PROVIDER_CONCURRENCY[provider]), ticker, key)
+
+
+def get_fmp_indicators(ticker, fmp_key):
+    return asyncio.run(_single_provider(_fmp_indicators_async, ticker, fmp_key, "fmp"))
+
+
+def get_alpha_indicators(ticker, alpha_key):
+    return asyncio.run(_single_provider(_alpha_indicators_async, ticker, alpha_key, "alpha"))
+
+
 # ---------- Función combinada con caché ----------
+def get_indicators_for_tickers(tickers, alpha_key, fmp_key):
+    """Indicadores de varios tickers: lo que falta o caducó se pide todo en paralelo"""
+    tickers = list(dict.fromkeys(t.upper() for t in tickers))
+    cache = load_cache(tickers)
+
+    pending = {}
+    for ticker in tickers:
+        cached = cache.get(ticker, {})
+        providers = [p for p, fields in PROVIDER_FIELDS.items() if any(f not in cached for f in fields)]
+        if providers:
+            pending[ticker] = providers
+
+    if pending:
+        fetched = asyncio.run(_fetch_indicators_async(pending, alpha_key, fmp_key))
+        save_cache(fetched)
+        for ticker, data in fetched.items():
+            cache.setdefault(ticker, {}).update(data)
+
+    results = {}
+    for ticker in tickers:
+        data = dict(DEFAULT_INDICATORS)
+        data.update(cache.get(ticker, {}))
+        results[ticker] = data
+    return results
+
+
 def get_all_indicators_with_cache(ticker, alpha_key, fmp_key):
     ticker = ticker.upper()
-    cache = load_cache()
-
-    if ticker in cache.index:
-        return cache.loc[ticker].to_dict()
-
-    data = {
-        "Net Profit Margin": "N/D",
-        "ROIC": "N/D",
-        "P/E Ratio": "N/D",
-        "P/B Ratio": "N/D",
-        "Quick Ratio": "N/D",
-        "Debt to Equity": "N/D",
-        "Dividend Yield": "N/D",
-        "Payout Ratio": "N/D"
-    }
-
-    data.update(get_fmp_indicators(ticker, fmp_key))
-    data.update(get_alpha_indicators(ticker, alpha_key))
-
-    save_cache(ticker, data)
-    return data
+    return get_indicators_for_tickers([ticker], alpha_key, fmp_key)[ticker]
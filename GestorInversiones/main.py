@@ -4,13 +4,15 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
-from database import save_operation, load_operations
-from reports import generate_report
-from portfolio import calculate_portfolio_metrics, procesar_venta
-from api_yfinance import get_current_price
-import yfinance as yf
-import requests
-import os
+from database import (save_operation, delete_operation, load_operations, export_operations_csv, new_operation_id,
+                      record_changes)
+from reports import export_report, preview_report, REPORT_FORMATS
+from portfolio import calculate_portfolio_metrics, planificar_venta, valorar_posiciones, valorar_operaciones
+from positions import PositionBook, COST_METHODS, DEFAULT_COST_METHOD, legacy_sales, migrate_legacy_sales
+from valuation import get_portfolio_history
+from risk import compute_risk, rolling_volatility, DEFAULT_BENCHMARK, VAR_CONFIDENCE
+from fundamentals import (fetch_fundamentals, fetch_fundamentals_many, classify_fundamentals,
+                          FUNDAMENTAL_FIELDS, INDICATOR_THRESHOLDS)
 
 # Configuración de la página
 st.set_page_config(
@@ -89,10 +91,45 @@ st.markdown("""
 # Inicializar sesión
 if 'operations' not in st.session_state:
     st.session_state.operations = load_operations()
+if 'cost_method' not in st.session_state:
+    st.session_state.cost_method = DEFAULT_COST_METHOD
+
+
+def rebuild_positions():
+    st.session_state.positions = PositionBook.from_operations(st.session_state.operations, st.session_state.cost_method)
+    # Las operaciones nuevas ya siguen las reglas actuales: basta revisar el ledger al reconstruir
+    st.session_state.legacy_sales = legacy_sales(st.session_state.operations)
+
+
+if 'positions' not in st.session_state or st.session_state.positions.method != st.session_state.cost_method:
+    rebuild_positions()
+
 
 # Header principal
 st.markdown("<h1 class='main-header'>📈 Investment Portfolio Tracker</h1>", unsafe_allow_html=True)
 
+# Ventas guardadas con las reglas antiguas (que ya reducían las compras): se descontarían dos veces
+if not st.session_state.legacy_sales.empty:
+    legado = st.session_state.legacy_sales
+    st.warning(f"⚠️ Hay {len(legado)} venta(s) registradas con el formato anterior "
+               f"({', '.join(sorted(legado['ticker'].astype(str).unique()))}). Sus acciones ya se habían "
+               "descontado de las compras, así que las cantidades y el costo base salen reducidos dos veces.")
+    if st.button("🛠️ Migrar ventas antiguas",
+                 help="Devuelve las acciones descontadas con una compra del mismo día y vuelve a registrar cada "
+                      "venta contra esa compra; la compra sintética que dejaba la venta pasa a precio por acción. "
+                      "El precio de venta no se guardaba: la ganancia realizada de esas ventas queda en -comisión."):
+        altas, bajas = migrate_legacy_sales(st.session_state.operations, new_operation_id)
+        st.session_state.operations = record_changes(added=altas, deleted=bajas)
+        rebuild_positions()
+        st.rerun()
+
+# Ventas que no cabían en las acciones de su fecha (p. ej. editadas a mano): se aplicaron recortadas
+if st.session_state.positions.clipped:
+    recortadas = st.session_state.positions.clipped
+    st.warning(f"⚠️ {len(recortadas)} venta(s) superan las acciones que había en su fecha y se aplicaron recortadas: "
+               + ", ".join(f"{r['ticker']} {r['fecha']:%Y-%m-%d} ({r['cantidad']:g} > {r['disponible']:g})"
+                           for r in recortadas))
+
 # Crear pestañas principales
 tab1, tab2, tab3, tab4, tab5 = st.tabs(["📝 Operaciones", "💼 Portfolio", "📊 Dashboard", "📋 Reportes", "🔍 Análisis Fundamental"])
 
@@ -101,6 +138,15 @@ tab1, tab2, tab3, tab4, tab5 = st.tabs(["📝 Operaciones", "💼 Portfolio", "
 # ============================================
 with tab1:
     st.header("Registrar Operación (Compra/Venta)")
+
+    st.selectbox(
+        "Método de costo para ventas",
+        list(COST_METHODS),
+        format_func=COST_METHODS.get,
+        key="cost_method",
+        on_change=rebuild_positions,
+        help="Qué lotes de compra se consideran vendidos al calcular la ganancia realizada"
+    )
     
     with st.form(key="operation_form"):
         col1, col2 = st.columns(2)
@@ -114,28 +160,39 @@ with tab1:
             operation_type = st.selectbox("Tipo de operación", ["Compra", "Venta"])
             commission = st.number_input("Comisión ($)", min_value=0.0, value=0.0, step=0.01)
             operation_date = st.date_input("Fecha", value=datetime.today())
+            sell_lots = st.text_input(
+                "Lotes a vender (opcional)",
+                help="Solo para ventas: IDs de lotes separados por coma (ver 💼 Portfolio → Lotes abiertos). "
+                     "Vacío = usar el método de costo seleccionado."
+            )
         
         submit_button = st.form_submit_button("✅ Registrar Operación", use_container_width=True)
 
         if submit_button:
             if ticker and quantity > 0 and price > 0:
                 operation = {
+                    "id": new_operation_id(),
                     "fecha": operation_date,
                     "ticker": ticker,
                     "cantidad": quantity,
                     "precio": price,
                     "tipo": operation_type,
-                    "comision": commission
+                    "comision": commission,
+                    "lotes": sell_lots.strip() if operation_type == "Venta" else None
                 }
 
                 try:
                     if operation_type == "Venta":
-                        updated_ops = procesar_venta(st.session_state.operations.copy(), operation)
-                        updated_ops.to_csv("operations.csv", index=False)
-                        st.session_state.operations = updated_ops
+                        operation = planificar_venta(st.session_state.positions, operation,
+                                                     st.session_state.operations)
+                    st.session_state.operations = save_operation(operation)
+
+                    # Las posiciones se actualizan en O(1); una operación con fecha anterior
+                    # a la última cambia el costo promedio y obliga a recalcular
+                    if pd.Timestamp(operation["fecha"]) >= st.session_state.positions.last_date:
+                        st.session_state.positions.apply(operation)
                     else:
-                        save_operation(operation)
-                        st.session_state.operations = load_operations()
+                        rebuild_positions()
 
                     st.success("✅ Operación registrada con éxito.")
                     st.balloons()
@@ -153,7 +210,7 @@ with tab1:
     if operations.empty:
         st.info("No hay operaciones registradas.")
     else:
-        st.dataframe(operations.reset_index(drop=True), use_container_width=True)
+        st.dataframe(operations.drop(columns=["id", "formato"]).reset_index(drop=True), use_container_width=True)
 
         # Eliminar operaciones
         with st.expander("❌ Eliminar Operación"):
@@ -165,8 +222,8 @@ with tab1:
             )
 
             if st.button("🗑️ Eliminar operación seleccionada"):
-                operations = operations.drop(index_to_delete).reset_index(drop=True)
-                operations.to_csv("operations.csv", index=False)
+                st.session_state.operations = delete_operation(operations.iloc[index_to_delete]["id"])
+                rebuild_positions()
                 st.success(f"✅ Operación #{index_to_delete} eliminada correctamente.")
                 st.rerun()
 
@@ -177,8 +234,8 @@ with tab2:
     st.header("💼 Portfolio Actual")
     
     # Métricas principales
-    metrics = calculate_portfolio_metrics(st.session_state.operations)
-    col1, col2, col3, col4 = st.columns(4)
+    metrics = calculate_portfolio_metrics(st.session_state.positions)
+    col1, col2, col3, col4, col5 = st.columns(5)
     
     with col1:
         st.metric("💰 Saldo Total", f"${metrics['total_balance']:.2f}")
@@ -189,24 +246,68 @@ with tab2:
         st.metric("💸 Ganancia Neta", f"${metrics['net_profit']:.2f}")
     with col4:
         st.metric("📈 Rendimiento", f"{metrics['profit_percentage']:.2f}%")
+    with col5:
+        st.metric("💵 Ganancia Realizada", f"${metrics['realized_profit']:.2f}")
+    if metrics['unpriced']:
+        st.warning(f"⚠️ No se pudo obtener el precio actual de: {', '.join(metrics['unpriced'])}. "
+                   "Esas posiciones no se incluyen en el saldo ni en el capital invertido.")
     
     st.markdown("---")
+
+    # Posiciones abiertas, leídas del agregado incremental
+    holdings = valorar_posiciones(st.session_state.positions)
+    if not holdings.empty:
+        st.subheader("📌 Posiciones Abiertas")
+        st.dataframe(holdings.round(2), use_container_width=True, hide_index=True)
+
+        with st.expander("🧾 Lotes abiertos"):
+            st.dataframe(st.session_state.positions.lots_frame(), use_container_width=True, hide_index=True)
+
+    realized = st.session_state.positions.realized_frame()
+    if not realized.empty:
+        with st.expander(f"💵 Ganancias realizadas ({COST_METHODS[st.session_state.positions.method]})"):
+            st.dataframe(realized.round(2), use_container_width=True, hide_index=True)
     
-    # Tabla del portfolio
+    # Métricas de riesgo sobre el histórico diario (solo se suman los días nuevos entre recargas)
+    if not st.session_state.operations.empty:
+        st.subheader("📉 Riesgo")
+        benchmark = st.text_input("Benchmark", value=DEFAULT_BENCHMARK, help="Ticker contra el que se calcula la beta")
+        with st.spinner("Calculando métricas de riesgo..."):
+            risk_metrics, st.session_state.risk_state, daily_returns, asset_risk = compute_risk(
+                st.session_state.operations, benchmark.strip().upper(), st.session_state.get('risk_state')
+            )
+        if risk_metrics:
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Volatilidad anual", f"{risk_metrics['volatilidad']:.2%}")
+                st.metric("Volatilidad 1M", f"{risk_metrics['volatilidad_movil']:.2%}")
+            with col2:
+                st.metric("Sharpe", f"{risk_metrics['sharpe']:.2f}")
+                st.metric("Sortino", f"{risk_metrics['sortino']:.2f}")
+            with col3:
+                st.metric("Máx. Drawdown", f"{risk_metrics['max_drawdown']:.2%}")
+                st.metric(f"Beta vs {benchmark}", f"{risk_metrics['beta']:.2f}")
+            with col4:
+                st.metric(f"VaR {VAR_CONFIDENCE:.0%} histórico (1 día)", f"{risk_metrics['var_historico']:.2%}")
+                st.metric(f"VaR {VAR_CONFIDENCE:.0%} paramétrico (1 día)", f"{risk_metrics['var_parametrico']:.2%}")
+
+            with st.expander("📈 Volatilidad móvil y riesgo por ticker"):
+                st.line_chart(rolling_volatility(daily_returns))
+                st.dataframe(asset_risk.round(3), use_container_width=True, hide_index=True)
+        else:
+            st.info("Se necesitan al menos dos días de histórico para calcular el riesgo.")
+
+    # Tabla del portfolio: cada compra vale por lo que queda abierto de su lote; cada venta muestra su ganancia realizada
     if not st.session_state.operations.empty:
         with st.spinner("Actualizando precios..."):
-            portfolio = st.session_state.operations.copy()
-            portfolio['precio_actual'] = portfolio['ticker'].apply(get_current_price)
-            portfolio['valor_actual'] = portfolio['cantidad'] * portfolio['precio_actual']
-            portfolio['ganancia_perdida'] = portfolio['valor_actual'] - (portfolio['precio'] * portfolio['cantidad']) - portfolio['comision']
-            portfolio['roi_%'] = ((portfolio['ganancia_perdida'] / (portfolio['precio'] * portfolio['cantidad'])) * 100).round(2)
-        
+            portfolio = valorar_operaciones(st.session_state.operations, st.session_state.positions)
+
         # Formatear para mostrar
         display_portfolio = portfolio.copy()
         display_portfolio['fecha'] = pd.to_datetime(display_portfolio['fecha']).dt.strftime('%Y-%m-%d')
         
         st.dataframe(
-            display_portfolio[['fecha', 'ticker', 'cantidad', 'precio', 'tipo', 'comision', 
+            display_portfolio[['fecha', 'ticker', 'cantidad', 'precio', 'tipo', 'comision', 'cantidad_abierta',
                              'precio_actual', 'valor_actual', 'ganancia_perdida', 'roi_%']],
             use_container_width=True
         )
@@ -223,26 +324,20 @@ with tab3:
     if st.session_state.operations.empty:
         st.warning("⚠️ No hay datos para mostrar. Registra algunas operaciones primero.")
     else:
-        # Preparar datos para el dashboard
-        df_operations = st.session_state.operations.copy()
-        
-        # Obtener precios actuales (con cache para optimizar)
-        @st.cache_data(ttl=300)  # Cache por 5 minutos
-        def get_dashboard_data(operations_data):
-            df = operations_data.copy()
-            df['precio_actual'] = df['ticker'].apply(get_current_price)
-            df['valor_actual'] = df['cantidad'] * df['precio_actual']
-            df['ganancia_perdida'] = df['valor_actual'] - (df['precio'] * df['cantidad']) - df['comision']
-            df['fecha'] = pd.to_datetime(df['fecha'])
-            return df
-        
+        # Preparar datos para el dashboard: una fila por posición abierta, con las ventas ya descontadas
+        # (la caché de cotizaciones de api_yfinance evita repetir descargas)
         with st.spinner("📊 Cargando dashboard..."):
-            dashboard_df = get_dashboard_data(df_operations)
+            dashboard_df = valorar_posiciones(st.session_state.positions)
+            sin_precio = dashboard_df.loc[dashboard_df['precio_actual'].isna(), 'ticker']
+            dashboard_df = dashboard_df[dashboard_df['precio_actual'].notna()].copy()
+            dashboard_df['ganancia_perdida'] = dashboard_df['ganancia_no_realizada']
+        if not sin_precio.empty:
+            st.warning(f"⚠️ Sin precio actual (excluidos del dashboard): {', '.join(sin_precio)}")
         
         # Métricas de resumen
         col1, col2, col3 = st.columns(3)
         
-        total_invertido = (dashboard_df['precio'] * dashboard_df['cantidad']).sum()
+        total_invertido = dashboard_df['costo_base'].sum()
         valor_actual = dashboard_df['valor_actual'].sum()
         ganancia_total = dashboard_df['ganancia_perdida'].sum()
         roi_total = (ganancia_total / total_invertido * 100) if total_invertido > 0 else 0
@@ -265,9 +360,7 @@ with tab3:
             # Gráfico de distribución por ticker
             st.subheader("🥧 Distribución del Portfolio")
             
-            allocation = dashboard_df.groupby('ticker').agg({
-                'valor_actual': 'sum'
-            }).reset_index()
+            allocation = dashboard_df[['ticker', 'valor_actual']]
             
             fig_pie = px.pie(
                 allocation,
@@ -283,12 +376,8 @@ with tab3:
             # Gráfico de rendimiento por ticker
             st.subheader("📊 Rendimiento por Ticker")
             
-            performance = dashboard_df.groupby('ticker').agg({
-                'ganancia_perdida': 'sum',
-                'precio': lambda x: (x * dashboard_df.loc[x.index, 'cantidad']).sum()  # Total invertido por ticker
-            }).reset_index()
-            
-            performance['roi_%'] = (performance['ganancia_perdida'] / performance['precio'] * 100).round(2)
+            performance = dashboard_df[['ticker', 'ganancia_perdida', 'costo_base']].copy()
+            performance['roi_%'] = (performance['ganancia_perdida'] / performance['costo_base'] * 100).round(2)
             
             fig_bar = px.bar(
                 performance.sort_values('roi_%', ascending=True),
@@ -305,27 +394,26 @@ with tab3:
         # Evolución temporal
         st.subheader("📈 Evolución Temporal del Portfolio")
         
-        # Crear datos para evolución temporal
-        dashboard_df_sorted = dashboard_df.sort_values('fecha').copy()
-        dashboard_df_sorted['valor_acumulado'] = dashboard_df_sorted['valor_actual'].cumsum()
-        dashboard_df_sorted['inversion_acumulada'] = (dashboard_df_sorted['precio'] * dashboard_df_sorted['cantidad']).cumsum()
+        # Valor diario real: posiciones de cada día x cierre histórico (descargado en bloque y cacheado en disco)
+        with st.spinner("📈 Cargando histórico de precios..."):
+            history = get_portfolio_history(st.session_state.operations)
         
         fig_evolution = go.Figure()
         
         fig_evolution.add_trace(go.Scatter(
-            x=dashboard_df_sorted['fecha'],
-            y=dashboard_df_sorted['inversion_acumulada'],
-            mode='lines+markers',
+            x=history.index,
+            y=history['invertido'],
+            mode='lines',
             name='Inversión Acumulada',
             line=dict(color='#ff7f0e', width=3),
-            fill='tonexty'
+            fill='tozeroy'
         ))
         
         fig_evolution.add_trace(go.Scatter(
-            x=dashboard_df_sorted['fecha'],
-            y=dashboard_df_sorted['valor_acumulado'],
-            mode='lines+markers',
-            name='Valor Actual',
+            x=history.index,
+            y=history['valor'],
+            mode='lines',
+            name='Valor del Portfolio',
             line=dict(color='#1f77b4', width=3),
             fill='tonexty'
         ))
@@ -371,36 +459,38 @@ with tab4:
         - 💰 Todas las operaciones con precios actualizados
         - 📈 Cálculo automático de ganancias/pérdidas
         - 📊 Resumen de totales y métricas principales
-        - 💾 Archivo CSV listo para Excel
+        - 💾 Archivo CSV, Parquet o Excel, escrito por bloques
         """)
     
     with col2:
+        report_format = st.selectbox("Formato", list(REPORT_FORMATS), format_func=str.upper)
+        preview_rows = st.number_input("Filas en la vista previa", min_value=10, max_value=1000, value=100, step=10)
         if st.button("🔄 Generar Reporte Completo", type="primary", use_container_width=True):
-            with st.spinner("Generando reporte..."):
-                report_path, report_df = generate_report(st.session_state.operations)
-            
-            st.success("✅ Reporte generado exitosamente!")
-            
-            # Mostrar métricas del reporte generado
-            if os.path.exists(report_path):
+            report_path = f"reporte_inversiones.{report_format}"
+            try:
+                with st.spinner("Generando reporte..."):
+                    totals = export_report(st.session_state.operations, report_path, report_format,
+                                           posiciones=st.session_state.positions)
+            except (ValueError, ImportError) as e:
+                st.error(f"❌ No se pudo generar el reporte: {str(e)}")
+            else:
+                st.success("✅ Reporte generado exitosamente!")
+                st.metric("Ganancia/Pérdida Total", f"${totals['ganancia_perdida']:,.2f}")
+
+                # El archivo se entrega tal cual desde el disco, sin volver a cargarlo como DataFrame
                 with open(report_path, "rb") as file:
-                    file_data = file.read()
-                    
-                st.download_button(
-                    label="⬇️ Descargar Reporte CSV",
-                    data=file_data,
-                    file_name="reporte_inversiones.csv",
-                    mime="text/csv",
-                    use_container_width=True
-                )
-                
-                # Mostrar vista previa del reporte
+                    st.download_button(
+                        label=f"⬇️ Descargar Reporte {report_format.upper()}",
+                        data=file,
+                        file_name=report_path,
+                        mime=REPORT_FORMATS[report_format],
+                        use_container_width=True
+                    )
+
+                # Mostrar vista previa del reporte (solo las primeras filas)
                 st.markdown("### 👀 Vista Previa del Reporte")
-                try:
-                    preview_df = pd.read_csv(report_path)
-                    st.dataframe(preview_df, use_container_width=True)
-                except Exception as e:
-                    st.error(f"Error al mostrar vista previa: {str(e)}")
+                st.dataframe(preview_report(st.session_state.operations, int(preview_rows), st.session_state.positions),
+                             use_container_width=True)
 
 # ============================================
 # TAB 5: ANÁLISIS FUNDAMENTAL
@@ -421,197 +511,20 @@ POLYGON_API_KEY = "yNQyvHiykwO8XUufJiPJwzGjhRJn3sr4"
 def get_fundamental_data(ticker):
     """Obtener datos fundamentales de una empresa usando múltiples fuentes"""
     try:
-        # Intentar con yfinance primero
-        stock = yf.Ticker(ticker)
-        info = stock.info
-        
-        # Calcular ROIC manualmente si es posible
-        roic = None
-        try:
-            # ROIC = (Net Income) / (Total Capital)
-            # O aproximado: ROE * (1 - Debt/Total Capital)
-            roe = info.get('returnOnEquity')
-            debt_to_equity = info.get('debtToEquity')
-            if roe and debt_to_equity:
-                # Aproximación simple de ROIC
-                total_capital_ratio = 1 / (1 + (debt_to_equity / 100))
-                roic = roe * total_capital_ratio * 100
-        except:
-            pass
-        
-        # Intentar obtener crecimiento de earnings de diferentes fuentes
-        earnings_growth_lt = None
-        try:
-            # Usar earningsQuarterlyGrowth como proxy si está disponible
-            quarterly_growth = info.get('earningsQuarterlyGrowth')
-            if quarterly_growth:
-                earnings_growth_lt = quarterly_growth * 100
-        except:
-            pass
-        
-        fundamentals = {
-            'Ticker': ticker,
-            'Name': info.get('longName', info.get('shortName', ticker)),
-            'Margen Neto (%)': info.get('profitMargins', None) * 100 if info.get('profitMargins') else None,
-            'ROIC (%)': roic,
-            'Crecimiento EPS 5Y (%)': info.get('earningsGrowth', None) * 100 if info.get('earningsGrowth') else None,
-            'Crecimiento Ganancias LT (%)': earnings_growth_lt,
-            'P/E Ratio': info.get('trailingPE', None),
-            'P/B Ratio': info.get('priceToBook', None),
-            'Ratio Liquidez Inmediata': info.get('quickRatio', None),
-            'Ratio Deuda/Patrimonio': info.get('debtToEquity', None) / 100 if info.get('debtToEquity') else None,
-            'Rentabilidad Dividendo (%)': info.get('dividendYield', None) if info.get('dividendYield') else None,
-            'Ratio Reparto Dividendos (%)': info.get('payoutRatio', None) * 100 if info.get('payoutRatio') else None
-        }
-        
-        # Si faltan datos críticos, intentar con múltiples APIs
-        missing_data = [k for k, v in fundamentals.items() if v is None and k not in ['Name', 'Ticker']]
-        
-        if len(missing_data) > 2:  # Si faltan más de 2 indicadores
-            # 1. Intentar con Financial Modeling Prep (FMP)
-            if FMP_API_KEY != "demo":
-                try:
-                    fmp_url = f"https://financialmodelingprep.com/api/v3/ratios/{ticker}?apikey={FMP_API_KEY}"
-                    fmp_response = requests.get(fmp_url, timeout=10).json()
-                    
-                    if fmp_response and len(fmp_response) > 0:
-                        fmp_data = fmp_response[0]  # Datos más recientes
-                        
-                        if fundamentals['ROIC (%)'] is None:
-                            roic_fmp = fmp_data.get('returnOnCapitalEmployed')
-                            if roic_fmp:
-                                fundamentals['ROIC (%)'] = roic_fmp * 100
-                        
-                        if fundamentals['Margen Neto (%)'] is None:
-                            net_profit_margin = fmp_data.get('netProfitMargin')
-                            if net_profit_margin:
-                                fundamentals['Margen Neto (%)'] = net_profit_margin * 100
-                        
-                        if fundamentals['P/E Ratio'] is None:
-                            pe_ratio = fmp_data.get('priceEarningsRatio')
-                            if pe_ratio:
-                                fundamentals['P/E Ratio'] = pe_ratio
-                        
-                        if fundamentals['P/B Ratio'] is None:
-                            pb_ratio = fmp_data.get('priceToBookRatio')
-                            if pb_ratio:
-                                fundamentals['P/B Ratio'] = pb_ratio
-                        
-                        if fundamentals['Ratio Liquidez Inmediata'] is None:
-                            quick_ratio = fmp_data.get('quickRatio')
-                            if quick_ratio:
-                                fundamentals['Ratio Liquidez Inmediata'] = quick_ratio
-                        
-                        if fundamentals['Ratio Deuda/Patrimonio'] is None:
-                            debt_equity = fmp_data.get('debtEquityRatio')
-                            if debt_equity:
-                                fundamentals['Ratio Deuda/Patrimonio'] = debt_equity
-                    
-                    # Intentar obtener datos de crecimiento de FMP
-                    growth_url = f"https://financialmodelingprep.com/api/v3/financial-growth/{ticker}?apikey={FMP_API_KEY}"
-                    growth_response = requests.get(growth_url, timeout=10).json()
-                    
-                    if growth_response and len(growth_response) > 0:
-                        growth_data = growth_response[0]
-                        if fundamentals['Crecimiento EPS 5Y (%)'] is None:
-                            eps_growth = growth_data.get('fiveYEarRevenueGrowthPerShare')
-                            if eps_growth:
-                                fundamentals['Crecimiento EPS 5Y (%)'] = eps_growth * 100
-                        
-                        if fundamentals['Crecimiento Ganancias LT (%)'] is None:
-                            revenue_growth = growth_data.get('revenueGrowth')
-                            if revenue_growth:
-                                fundamentals['Crecimiento Ganancias LT (%)'] = revenue_growth * 100
-                
-                except Exception as e:
-                    st.warning(f"⚠️ FMP API error para {ticker}")
-            
-            # 2. Intentar con Alpha Vantage como backup
-            try:
-                url = f"https://www.alphavantage.co/query?function=OVERVIEW&symbol={ticker}&apikey={ALPHA_VANTAGE_API_KEY}"
-                response = requests.get(url, timeout=10).json()
-                
-                if 'Symbol' in response:
-                    # Completar datos faltantes con Alpha Vantage
-                    if fundamentals['Margen Neto (%)'] is None:
-                        profit_margin = response.get('ProfitMargin')
-                        if profit_margin and profit_margin != 'None':
-                            fundamentals['Margen Neto (%)'] = float(profit_margin) * 100
-                    
-                    if fundamentals['P/E Ratio'] is None:
-                        pe_ratio = response.get('PERatio')
-                        if pe_ratio and pe_ratio != 'None':
-                            fundamentals['P/E Ratio'] = float(pe_ratio)
-                    
-                    if fundamentals['P/B Ratio'] is None:
-                        pb_ratio = response.get('PriceToBookRatio')
-                        if pb_ratio and pb_ratio != 'None':
-                            fundamentals['P/B Ratio'] = float(pb_ratio)
-                    
-                    # Calcular ROIC con datos de Alpha Vantage si no se pudo antes
-                    if fundamentals['ROIC (%)'] is None:
-                        roe_av = response.get('ReturnOnEquityTTM')
-                        debt_equity_av = response.get('DebtToEquityRatio')
-                        if roe_av and debt_equity_av and roe_av != 'None' and debt_equity_av != 'None':
-                            try:
-                                roe_val = float(roe_av)
-                                de_val = float(debt_equity_av)
-                                total_capital_ratio = 1 / (1 + de_val)
-                                fundamentals['ROIC (%)'] = roe_val * total_capital_ratio
-                            except:
-                                pass
-                    
-                    # Intentar obtener growth rates
-                    if fundamentals['Crecimiento Ganancias LT (%)'] is None:
-                        analyst_target = response.get('AnalystTargetPrice')
-                        current_price = response.get('Price')
-                        if analyst_target and current_price and analyst_target != 'None' and current_price != 'None':
-                            try:
-                                # Aproximación muy básica basada en target price
-                                target_val = float(analyst_target)
-                                current_val = float(current_price)
-                                implied_growth = ((target_val / current_val) - 1) * 100
-                                if -50 <= implied_growth <= 100:  # Filtrar valores extremos
-                                    fundamentals['Crecimiento Ganancias LT (%)'] = implied_growth
-                            except:
-                                pass
-                        
-            except Exception as e:
-                st.warning(f"⚠️ Alpha Vantage no disponible para {ticker}")
-            
-            # 3. Intentar con Polygon.io para datos adicionales
-            if POLYGON_API_KEY != "demo" and len([k for k, v in fundamentals.items() if v is None and k not in ['Name', 'Ticker']]) > 1:
-                try:
-                    # Polygon para datos financieros básicos
-                    polygon_url = f"https://api.polygon.io/vX/reference/financials?ticker={ticker}&apikey={POLYGON_API_KEY}"
-                    polygon_response = requests.get(polygon_url, timeout=10).json()
-                    
-                    if polygon_response.get('status') == 'OK' and polygon_response.get('results'):
-                        financials = polygon_response['results'][0]  # Datos más recientes
-                        
-                        # Polygon tiene estructura diferente, ajustar según su documentación
-                        # Esto es un ejemplo básico, necesitarías ajustar según la respuesta real
-                        if 'financials' in financials:
-                            fin_data = financials['financials']
-                            
-                            # Intentar extraer ratios si están disponibles
-                            if 'balance_sheet' in fin_data and 'income_statement' in fin_data:
-                                try:
-                                    # Cálculos básicos con datos de Polygon si están disponibles
-                                    pass  # Implementar según estructura de respuesta
-                                except:
-                                    pass
-                
-                except Exception as e:
-                    st.warning(f"⚠️ Polygon API error para {ticker}")
-        
-        
-        return fundamentals
-        
+        fundamentals, avisos = fetch_fundamentals(ticker, FMP_API_KEY, ALPHA_VANTAGE_API_KEY, POLYGON_API_KEY)
     except Exception as e:
         st.error(f"❌ Error al obtener datos para {ticker}: {str(e)}")
         return None
 
+    for aviso in avisos:
+        st.warning(aviso)
+    return fundamentals
+
+@st.cache_data(ttl=3600)  # Cache por 1 hora
+def get_portfolio_fundamentals(tickers):
+    """Datos fundamentales de todos los tickers del portafolio en una sola pasada paralela"""
+    return fetch_fundamentals_many(tickers, FMP_API_KEY, ALPHA_VANTAGE_API_KEY, POLYGON_API_KEY)
+
 # Función mejorada para mostrar indicadores con explicación de datos faltantes
 def display_indicator_card_improved(label, value, threshold_good=None, threshold_bad=None, is_percentage=True, higher_is_better=True, explanation=None):
     """Mostrar indicador mejorado con explicaciones"""
@@ -657,6 +570,49 @@ def display_indicator_card_improved(label, value, threshold_good=None, threshold
     </div>
     """, unsafe_allow_html=True)
 
+with mode_tab1:
+    st.subheader("📦 Mi Portafolio")
+
+    if st.session_state.operations.empty:
+        st.info("📋 No hay operaciones registradas")
+    else:
+        portfolio_tickers = tuple(sorted(st.session_state.operations['ticker'].dropna().astype(str).unique()))
+
+        with st.spinner(f"Obteniendo datos fundamentales de {len(portfolio_tickers)} empresas..."):
+            screen_df, avisos = get_portfolio_fundamentals(portfolio_tickers)
+        for aviso in avisos:
+            st.warning(aviso)
+
+        if screen_df.empty:
+            st.error("❌ No se encontraron datos fundamentales para los tickers del portafolio.")
+        else:
+            status_df = classify_fundamentals(screen_df)
+            screen_df['Excelentes'] = (status_df == 'Excelente').sum(axis=1)
+            screen_df['Alertas'] = (status_df == 'Preocupante').sum(axis=1)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                min_excelentes = st.slider("Mínimo de indicadores excelentes", 0, len(FUNDAMENTAL_FIELDS), 0)
+            with col2:
+                solo_sin_alertas = st.checkbox("Ocultar empresas con indicadores preocupantes")
+
+            mask = screen_df['Excelentes'] >= min_excelentes
+            if solo_sin_alertas:
+                mask &= screen_df['Alertas'] == 0
+            filtered = screen_df[mask]
+            filtered_status = status_df[mask]
+
+            colors = {'Excelente': 'color: #2ecc71', 'Preocupante': 'color: #e74c3c',
+                      'Aceptable': 'color: #f1c40f', 'N/A': 'color: #666666'}
+            styles = filtered_status.replace(colors).reindex(columns=filtered.columns, fill_value='')
+
+            st.dataframe(
+                filtered.style.apply(lambda _: styles, axis=None).format(precision=2, na_rep="N/A"),
+                use_container_width=True,
+                hide_index=True
+            )
+            st.caption(f"{len(filtered)} de {len(screen_df)} empresas · Haz clic en una columna para ordenar")
+
 # NUEVA SECCIÓN PARA "EXPLORAR EMPRESA" (reemplaza la existente):
 with mode_tab2:
     st.subheader("🔎 Explorar Empresa")
@@ -669,13 +625,8 @@ with mode_tab2:
                 fundamentals = get_fundamental_data(ticker_input)
                 
                 if fundamentals:
-                    # Obtener información adicional de la empresa
-                    try:
-                        stock = yf.Ticker(ticker_input)
-                        info = stock.info
-                        company_name = fundamentals['Name']
-                    except:
-                        company_name = ticker_input
+                    # El nombre ya viene del mismo payload de yfinance usado para los indicadores
+                    company_name = fundamentals.get('Name') or ticker_input
                     
                     st.success(f"✅ Análisis completado")
                     
@@ -690,40 +641,40 @@ with mode_tab2:
                     
                     with col1:
                         st.markdown("**Rentabilidad**")
-                        display_indicator_card_improved("Margen Neto", fundamentals['Margen Neto (%)'], 10, 0)
+                        display_indicator_card_improved("Margen Neto", fundamentals['Margen Neto (%)'], **INDICATOR_THRESHOLDS['Margen Neto (%)'])
                         display_indicator_card_improved(
                             "ROIC", 
                             fundamentals['ROIC (%)'], 
-                            20, 5,
+                            **INDICATOR_THRESHOLDS['ROIC (%)'],
                             explanation="Calculado aproximadamente. Para datos precisos consultar reportes financieros."
                         )
                     
                     with col2:
                         st.markdown("**Crecimiento**")
-                        display_indicator_card_improved("Crecimiento EPS 5Y", fundamentals['Crecimiento EPS 5Y (%)'], 10, 0)
+                        display_indicator_card_improved("Crecimiento EPS 5Y", fundamentals['Crecimiento EPS 5Y (%)'], **INDICATOR_THRESHOLDS['Crecimiento EPS 5Y (%)'])
                         display_indicator_card_improved(
                             "Crecimiento Ganancias LT", 
                             fundamentals['Crecimiento Ganancias LT (%)'], 
-                            8, 0,
+                            **INDICATOR_THRESHOLDS['Crecimiento Ganancias LT (%)'],
                             explanation="Datos limitados en APIs gratuitas. Consultar análisis de analistas."
                         )
                     
                     col3, col4 = st.columns(2)
                     with col3:
                         st.markdown("**Evaluación**")
-                        display_indicator_card_improved("P/E Ratio", fundamentals['P/E Ratio'], 15, 30, is_percentage=False, higher_is_better=False)
-                        display_indicator_card_improved("P/B Ratio", fundamentals['P/B Ratio'], 2, 5, is_percentage=False, higher_is_better=False)
+                        display_indicator_card_improved("P/E Ratio", fundamentals['P/E Ratio'], **INDICATOR_THRESHOLDS['P/E Ratio'], is_percentage=False)
+                        display_indicator_card_improved("P/B Ratio", fundamentals['P/B Ratio'], **INDICATOR_THRESHOLDS['P/B Ratio'], is_percentage=False)
                     
                     with col4:
                         st.markdown("**Deuda**")
-                        display_indicator_card_improved("Ratio Liquidez Inmediata", fundamentals['Ratio Liquidez Inmediata'], 1, 0.5, is_percentage=False)
-                        display_indicator_card_improved("Ratio Deuda/Patrimonio", fundamentals['Ratio Deuda/Patrimonio'], 0.5, 1, is_percentage=False, higher_is_better=False)
+                        display_indicator_card_improved("Ratio Liquidez Inmediata", fundamentals['Ratio Liquidez Inmediata'], **INDICATOR_THRESHOLDS['Ratio Liquidez Inmediata'], is_percentage=False)
+                        display_indicator_card_improved("Ratio Deuda/Patrimonio", fundamentals['Ratio Deuda/Patrimonio'], **INDICATOR_THRESHOLDS['Ratio Deuda/Patrimonio'], is_percentage=False)
                     
                     col5, col6 = st.columns(2)
                     with col5:
                         st.markdown("**Dividendos**")
-                        display_indicator_card_improved("Rentabilidad Dividendo", fundamentals['Rentabilidad Dividendo (%)'], 3, 0)
-                        display_indicator_card_improved("Ratio Reparto Dividendos", fundamentals['Ratio Reparto Dividendos (%)'], 30, 70, higher_is_better=False)
+                        display_indicator_card_improved("Rentabilidad Dividendo", fundamentals['Rentabilidad Dividendo (%)'], **INDICATOR_THRESHOLDS['Rentabilidad Dividendo (%)'])
+                        display_indicator_card_improved("Ratio Reparto Dividendos", fundamentals['Ratio Reparto Dividendos (%)'], **INDICATOR_THRESHOLDS['Ratio Reparto Dividendos (%)'])
                     
                     # Sección de recomendaciones para datos faltantes
                     with st.expander("📚 ¿Dónde encontrar los datos faltantes?"):
@@ -761,6 +712,7 @@ with st.sidebar:
     # Botón de actualización
     if st.button("🔄 Actualizar Datos", use_container_width=True):
         st.session_state.operations = load_operations()
+        rebuild_positions()
         st.rerun()
     
     st.markdown("---")
@@ -769,7 +721,7 @@ with st.sidebar:
     if st.button("💾 Backup de Operaciones"):
         if not st.session_state.operations.empty:
             backup_name = f"backup_operations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            st.session_state.operations.to_csv(backup_name, index=False)
+            export_operations_csv(backup_name)
             st.success(f"✅ Backup creado: {backup_name}")
         else:
             st.warning("⚠️ No hay operaciones para respaldar")
\ No newline at end of file
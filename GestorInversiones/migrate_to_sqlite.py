@@ -0,0 +1,60 @@
+# migrate_to_sqlite.py
+# Convierte el ledger Parquet actual (o operations.csv si no hay Parquet) y los
+# backup_operations_*.csv a la base SQLite usada con GESTOR_STORAGE=sqlite.
+import argparse
+import glob
+import os
+
+import pandas as pd
+
+from database import (OPERATIONS_CSV, OPERATIONS_DB, OPERATIONS_JOURNAL, OPERATIONS_PARQUET, ParquetJournalStore,
+                      SQLiteStore)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrar el ledger de operaciones a SQLite")
+    parser.add_argument("--db", default=OPERATIONS_DB, help="Ruta de la base SQLite de destino")
+    parser.add_argument("--backups", default="backup_operations_*.csv", help="Patrón de los backups CSV")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--csv", help=f"CSV de operaciones a importar (por defecto, {OPERATIONS_PARQUET} + diario "
+                                      f"si existe; si no, {OPERATIONS_CSV})")
+    source.add_argument("--from-parquet", action="store_true",
+                        help="Usar el ledger Parquet + diario actual (lo predeterminado si existe)")
+    args = parser.parse_args()
+
+    # El Parquet + diario es el ledger activo: el CSV solo se actualiza al exportar
+    ledger_mtime = max((os.path.getmtime(p) for p in (OPERATIONS_PARQUET, OPERATIONS_JOURNAL) if os.path.exists(p)),
+                       default=None)
+    csv_path = args.csv or OPERATIONS_CSV
+    csv_stale = (ledger_mtime is not None and os.path.exists(csv_path)
+                 and os.path.getmtime(csv_path) < ledger_mtime)
+
+    if args.from_parquet or (args.csv is None and os.path.exists(OPERATIONS_PARQUET)):
+        if not os.path.exists(OPERATIONS_PARQUET):
+            parser.error(f"No existe {OPERATIONS_PARQUET}")
+        operations = ParquetJournalStore().load()
+        if csv_stale:
+            print(f"ℹ️ {csv_path} es anterior al ledger Parquet: se ignora")
+    elif os.path.exists(csv_path):
+        if csv_stale:
+            print(f"⚠️ {csv_path} es anterior al ledger Parquet y puede no tener las últimas operaciones "
+                  f"(usa --from-parquet para migrar el ledger activo)")
+        operations = pd.read_csv(csv_path)
+    else:
+        parser.error(f"No existe {csv_path}")
+
+    store = SQLiteStore(args.db)
+
+    store.replace_all(operations)
+    print(f"✅ {len(operations)} operaciones importadas en {args.db}")
+
+    for path in sorted(glob.glob(args.backups)):
+        name = os.path.splitext(os.path.basename(path))[0]
+        count = store.import_backup(name, pd.read_csv(path))
+        print(f"💾 Backup {name}: {count} operaciones")
+
+    store.compact()
+
+
+if __name__ == "__main__":
+    main()
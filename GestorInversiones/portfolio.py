@@ -1,99 +1,127 @@
+import numpy as np
 import pandas as pd
-from api_yfinance import get_current_price
-
-def calculate_portfolio_metrics(operations):
-    total_invested = 0.0
-    total_value = 0.0
-    net_profit = 0.0
-    total_retirado = 0.0
-
-    if not operations.empty:
-        operations = operations.copy()
-        operations['precio_actual'] = operations['ticker'].apply(get_current_price)
-
-        # Solo usar operaciones tipo Compra
-        compras = operations[operations['tipo'] == 'Compra'].copy()
-        compras['valor_actual'] = compras['cantidad'] * compras['precio_actual']
-
-        total_invested = (operations[operations['tipo'] == 'Compra']['cantidad'] * operations[operations['tipo'] == 'Compra']['precio']).sum() - \
-                         (operations[operations['tipo'] == 'Venta']['cantidad'] * operations[operations['tipo'] == 'Venta']['precio']).sum()
-        total_value = compras['valor_actual'].sum()
-    
-
-    # El saldo total real es el valor de tus acciones menos lo que retiraste
-    total_balance = total_value
-    total_invested = total_invested
+from api_yfinance import get_current_prices
+from positions import PositionBook, parse_lot_ids
+
+
+def valorar_posiciones(posiciones, precios=None):
+    """Posiciones abiertas con precio actual, valor y ganancia no realizada (las ventas ya están descontadas)"""
+    holdings = posiciones.to_frame()
+    abiertas = holdings[holdings['cantidad'] > 0].copy()
+    if precios is None:
+        precios = get_current_prices(abiertas['ticker']) if not abiertas.empty else {}
+    abiertas['precio_actual'] = abiertas['ticker'].map(precios).astype(float)
+    abiertas['valor_actual'] = abiertas['cantidad'] * abiertas['precio_actual']
+    abiertas['ganancia_no_realizada'] = abiertas['valor_actual'] - abiertas['costo_base']
+    return abiertas
+
+
+def valorar_operaciones(operations, posiciones, precios=None):
+    """Valor actual de cada operación según las posiciones.
+
+    Una compra vale solo por las acciones de su lote que siguen abiertas (ganancia no realizada);
+    una venta no aporta valor y muestra la ganancia realizada de los lotes que consumió.
+    'costo_base' es el costo de las acciones abiertas del lote (compra) o de los lotes consumidos (venta).
+    """
+    df = operations.copy()
+    tickers = df['ticker'].astype(object)
+    if precios is None:
+        precios = get_current_prices(tickers.dropna().unique())
+    df['precio_actual'] = tickers.map(precios).astype(float)
+
+    ids = df['id'].astype(str)
+    compra = (df['tipo'].astype(object) == 'Compra').to_numpy()
+    lots = posiciones.lots_frame().set_index('lote_id')
+    realized = posiciones.realized_frame().groupby('venta_id')[['costo', 'ganancia']].sum()
+
+    df['cantidad_abierta'] = np.where(compra, ids.map(lots['cantidad']).fillna(0.0), 0.0)
+    costo = np.where(compra, ids.map(lots['costo_base']).fillna(0.0), ids.map(realized['costo']).fillna(0.0))
+    df['costo_base'] = costo
+    df['valor_actual'] = df['cantidad_abierta'] * df['precio_actual']
+    df['ganancia_perdida'] = np.where(compra, df['valor_actual'] - costo, ids.map(realized['ganancia']).fillna(0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['roi_%'] = np.where(costo > 0, df['ganancia_perdida'] / costo * 100, np.nan).round(2)
+    return df
+
+
+def calculate_portfolio_metrics(posiciones):
+    """Métricas del portafolio leídas del agregado de posiciones (no del historial completo)"""
+    holdings = posiciones.to_frame()
+    abiertas = valorar_posiciones(posiciones)
+    # Sin cotización no hay valor: su costo queda fuera del capital invertido para no falsear la ganancia
+    sin_precio = abiertas['precio_actual'].isna()
+    cotizadas = abiertas[~sin_precio]
+
+    # El saldo total es el valor actual de las acciones en cartera
+    total_balance = cotizadas['valor_actual'].sum()
+    total_invested = cotizadas['costo_base'].sum()
     net_profit = total_balance - total_invested
-    
+    realized_profit = holdings['realizado'].sum()
 
     # Rendimiento
     profit_percentage = (net_profit / total_invested * 100) if total_invested > 0 else 0.0
 
     return {
         "total_balance": round(total_balance, 2),         # Valor actual del portafolio
-        "total_invested": round(total_invested, 2),       # Lo que pagaste por tus compras
+        "total_invested": round(total_invested, 2),       # Costo de las acciones que sigues teniendo
         "net_profit": round(net_profit, 2),               # Diferencia entre valor actual e inversión
-        "profit_percentage": round(profit_percentage, 2)  # % de ganancia o pérdida
+        "profit_percentage": round(profit_percentage, 2), # % de ganancia o pérdida
+        "realized_profit": round(realized_profit, 2),     # Ganancia ya materializada en ventas
+        "unpriced": sorted(abiertas.loc[sin_precio, 'ticker'])  # Tickers sin precio, excluidos de los totales
     }
 
 
-def procesar_venta(operations_df, venta):
+def planificar_venta(posiciones, venta, operations=None):
+    """Validar una venta contra las posiciones y devolver la operación a registrar.
+
+    Una venta con fecha anterior a la última operación se valida con las acciones que había ese día:
+    se rehace el ledger (`operations`) con la venta incluida y se rechaza si ella u otra venta
+    posterior dejan de caber.
+    """
     ticker = venta["ticker"]
     cantidad_a_vender = venta["cantidad"]
-    costo_total_vendido = venta["precio"]  # Aquí tú ingresarás cuánto pagaste por lo que estás vendiendo
-    comision = venta["comision"]
-    fecha = venta["fecha"]
+    lot_ids = parse_lot_ids(venta.get("lotes"))
 
-    compras = operations_df[
-        (operations_df["ticker"] == ticker) & 
-        (operations_df["tipo"] == "Compra")
-    ].copy()
-
-    if compras.empty:
+    if posiciones.quantity(ticker) <= 0:
         raise ValueError(f"No tienes acciones de {ticker} para vender.")
-
-    compras["fecha"] = pd.to_datetime(compras["fecha"])
-    compras = compras.sort_values("fecha")
-
-    total_disponible = compras["cantidad"].sum()
+    if lot_ids:
+        desconocidos = [l for l in lot_ids if l not in posiciones.positions[ticker].lots]
+        if desconocidos:
+            raise ValueError(f"Lotes abiertos de {ticker} no encontrados: {', '.join(desconocidos)}")
+    total_disponible = posiciones.available(ticker, lot_ids)
     if cantidad_a_vender > total_disponible:
         raise ValueError(f"No tienes suficientes acciones de {ticker} para vender ({cantidad_a_vender} > {total_disponible})")
 
-    # ↓ Paso 1: Eliminar todas las compras del ticker
-    operations_df = operations_df[~((operations_df["ticker"] == ticker) & (operations_df["tipo"] == "Compra"))]
-
-    # ↓ Paso 2: Calcular cantidad restante
-    cantidad_restante = total_disponible - cantidad_a_vender
-
-    # ↓ Paso 3: Calcular nuevo precio total restante
-    # Sumamos todos los precios pagados por compras originales
-    total_pagado_anterior = (compras["precio"]).sum()
-    costo_restante = total_pagado_anterior - costo_total_vendido
-
-    if cantidad_restante > 0:
-        nuevo_precio_unitario = costo_restante / cantidad_restante
-        nuevo_precio = total_pagado_anterior - costo_total_vendido
-
-        nueva_compra = {
-            "fecha": fecha,
-            "ticker": ticker,
-            "cantidad": cantidad_restante,
-            "precio": round(nuevo_precio, 2),
-            "tipo": "Compra",
-            "comision": 0.0  # Podrías ajustar esto si divides comisiones
-        }
-
-        operations_df = pd.concat([operations_df, pd.DataFrame([nueva_compra])], ignore_index=True)
-
-    # ↓ Paso 4: Registrar la venta como operación
+    # La venta se registra tal cual (precio = precio de venta por acción); las compras no se tocan.
+    # Los lotes consumidos los decide el método de costo, salvo que se indiquen explícitamente.
     nueva_venta = {
-        "fecha": fecha,
+        "id": venta.get("id"),
+        "fecha": venta["fecha"],
         "ticker": ticker,
         "cantidad": cantidad_a_vender,
-        "precio": venta["precio"],  # Aquí tú pondrás cuánto pagaste por esas acciones vendidas
+        "precio": venta["precio"],
         "tipo": "Venta",
-        "comision": comision
+        "comision": venta["comision"],
+        "lotes": ",".join(lot_ids) or None
     }
+    fecha = pd.Timestamp(venta["fecha"])
+    if fecha < posiciones.last_date:
+        if operations is None:
+            raise ValueError("Para validar una venta con fecha anterior a la última operación hacen falta las operaciones")
+        rehecho = PositionBook.from_operations(
+            pd.concat([operations, pd.DataFrame([{**nueva_venta, "fecha": fecha}])], ignore_index=True),
+            posiciones.method
+        )
+        ya_recortadas = {r["venta_id"] for r in posiciones.clipped}
+        nuevas = [r for r in rehecho.clipped if r["venta_id"] not in ya_recortadas]
+        if nuevas:
+            detalle = ", ".join(f"{r['fecha']:%Y-%m-%d} ({r['cantidad']:g} > {r['disponible']:g})" for r in nuevas)
+            raise ValueError(f"No tenías suficientes acciones de {ticker} el {fecha:%Y-%m-%d}: "
+                             f"quedarían ventas sin cubrir el {detalle}")
+    return nueva_venta
+
 
+def procesar_venta(operations_df, venta):
+    nueva_venta = planificar_venta(PositionBook.from_operations(operations_df), venta, operations_df)
     operations_df = pd.concat([operations_df, pd.DataFrame([nueva_venta])], ignore_index=True)
     return operations_df.reset_index(drop=True)
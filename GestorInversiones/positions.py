@@ -0,0 +1,301 @@
+# positions.py
+import logging
+from collections import OrderedDict
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Métodos de asignación de costo para las ventas
+COST_METHODS = {
+    "FIFO": "FIFO (primero en entrar, primero en salir)",
+    "LIFO": "LIFO (último en entrar, primero en salir)",
+    "PROMEDIO": "Costo promedio",
+}
+DEFAULT_COST_METHOD = "FIFO"
+
+_EPS = 1e-9
+
+
+def parse_lot_ids(lotes):
+    """'id1, id2' -> ['id1', 'id2'] (vacío si la venta no indica lotes)"""
+    if lotes is None or (not isinstance(lotes, str) and pd.isna(lotes)):
+        return []
+    return [l.strip() for l in str(lotes).split(",") if l.strip()]
+
+
+class Lot:
+    __slots__ = ("id", "fecha", "cantidad", "costo_unitario")
+
+    def __init__(self, lot_id, fecha, cantidad, costo_unitario):
+        self.id = lot_id
+        self.fecha = fecha
+        self.cantidad = cantidad
+        self.costo_unitario = costo_unitario  # precio + comisión de compra repartida por acción
+
+
+class Position:
+    __slots__ = ("cantidad", "costo", "realizado", "lots")
+
+    def __init__(self):
+        self.cantidad = 0.0   # acciones en cartera
+        self.costo = 0.0      # costo base de las acciones en cartera (incluye comisiones de compra)
+        self.realizado = 0.0  # ganancia/pérdida realizada en ventas, neta de comisiones
+        # Lotes abiertos en orden de compra: id -> Lot. Permite sacar por el principio (FIFO),
+        # por el final (LIFO) o un lote concreto en O(1).
+        self.lots = OrderedDict()
+
+    @property
+    def precio_medio(self):
+        return self.costo / self.cantidad if self.cantidad > 0 else 0.0
+
+
+class PositionBook:
+    """Posiciones por ticker a nivel de lote, mantenidas de forma incremental.
+
+    Cada compra abre un lote; cada venta consume lotes según el método (FIFO, LIFO o
+    costo promedio) o los lotes indicados en la operación, en O(lotes tocados), y deja
+    un registro de ganancia realizada por lote.
+    """
+
+    def __init__(self, method=DEFAULT_COST_METHOD):
+        if method not in COST_METHODS:
+            raise ValueError(f"Método de costo desconocido: {method}")
+        self.method = method
+        self.positions = {}
+        self.realized = []
+        self.clipped = []  # ventas que superaban las acciones disponibles y se aplicaron recortadas
+        self.last_date = pd.Timestamp.min
+
+    @classmethod
+    def from_operations(cls, operations, method=DEFAULT_COST_METHOD, strict=False):
+        """Reconstruir las posiciones del ledger en orden de fecha.
+
+        Con strict=False una venta mayor a la posición no detiene la reconstrucción: se aplica hasta
+        dejarla en cero y queda anotada en `clipped`.
+        """
+        book = cls(method)
+        if operations.empty:
+            return book
+        columns = [c for c in ["id", "fecha", "ticker", "cantidad", "precio", "tipo", "comision", "lotes"]
+                   if c in operations.columns]
+        # Sin hora en las operaciones: dentro del mismo día las compras se aplican antes que las ventas
+        ordered = operations.assign(_venta=operations["tipo"].astype(object) == "Venta")
+        ordered = ordered.sort_values(["fecha", "_venta"], kind="stable")
+        for op in ordered[columns].itertuples(index=False):
+            book.apply(op._asdict(), strict=strict)
+        return book
+
+    def quantity(self, ticker):
+        position = self.positions.get(ticker)
+        return position.cantidad if position else 0.0
+
+    def available(self, ticker, lot_ids=None):
+        """Acciones vendibles del ticker, o solo de los lotes indicados"""
+        position = self.positions.get(ticker)
+        if position is None:
+            return 0.0
+        if lot_ids:
+            return sum(position.lots[l].cantidad for l in lot_ids if l in position.lots)
+        return position.cantidad
+
+    def _lots_to_consume(self, position, lot_ids):
+        # Lotes en el orden en que deben consumirse (se vuelve a mirar tras cada lote agotado)
+        if lot_ids:
+            for lot_id in lot_ids:
+                if lot_id in position.lots:
+                    yield position.lots[lot_id]
+        elif self.method == "LIFO":
+            while position.lots:
+                yield next(reversed(position.lots.values()))
+        else:  # FIFO y costo promedio consumen las cantidades en orden de compra
+            while position.lots:
+                yield next(iter(position.lots.values()))
+
+    def _sell(self, ticker, position, op, cantidad, strict):
+        precio = float(op["precio"])
+        comision = float(op.get("comision") or 0.0)
+        lot_ids = parse_lot_ids(op.get("lotes"))
+        disponible = self.available(ticker, lot_ids)
+        if cantidad > disponible + _EPS:
+            if strict:
+                raise ValueError(f"No tienes suficientes acciones de {ticker} para vender ({cantidad} > {disponible})")
+            self.clipped.append({"venta_id": op.get("id"), "ticker": ticker, "fecha": pd.Timestamp(op["fecha"]),
+                                 "cantidad": cantidad, "disponible": disponible})
+            logger.warning("Venta %s de %s del %s recortada: %s > %s disponibles",
+                           op.get("id"), ticker, pd.Timestamp(op["fecha"]).date(), cantidad, disponible)
+            cantidad = disponible
+        if cantidad <= _EPS:
+            return
+
+        precio_medio = position.precio_medio
+        comision_unitaria = comision / cantidad
+        pendiente = cantidad
+        for lot in self._lots_to_consume(position, lot_ids):
+            if pendiente <= _EPS:
+                break
+            usado = min(lot.cantidad, pendiente)
+            costo_unitario = precio_medio if self.method == "PROMEDIO" else lot.costo_unitario
+            costo = usado * costo_unitario
+            ingreso = usado * (precio - comision_unitaria)
+
+            self.realized.append({
+                "venta_id": op.get("id"),
+                "ticker": ticker,
+                "lote_id": lot.id,
+                "fecha_compra": lot.fecha,
+                "fecha_venta": pd.Timestamp(op["fecha"]),
+                "cantidad": usado,
+                "costo": costo,
+                "ingreso": ingreso,
+                "ganancia": ingreso - costo,
+            })
+            position.realizado += ingreso - costo
+            position.costo -= costo
+            position.cantidad -= usado
+            lot.cantidad -= usado
+            pendiente -= usado
+            if lot.cantidad <= _EPS:
+                del position.lots[lot.id]
+
+        if position.cantidad <= _EPS or not position.lots:
+            position.cantidad = 0.0
+            position.costo = 0.0
+
+    def apply(self, op, strict=True):
+        ticker = str(op["ticker"])
+        cantidad = float(op["cantidad"])
+        position = self.positions.get(ticker)
+        if position is None:
+            position = self.positions[ticker] = Position()
+
+        if op["tipo"] == "Compra":
+            costo = cantidad * float(op["precio"]) + float(op.get("comision") or 0.0)
+            lot_id = str(op.get("id") or f"{ticker}-{len(position.lots)}-{op['fecha']}")
+            if cantidad > 0:
+                position.lots[lot_id] = Lot(lot_id, pd.Timestamp(op["fecha"]), cantidad, costo / cantidad)
+            position.cantidad += cantidad
+            position.costo += costo
+        elif op["tipo"] == "Venta":
+            self._sell(ticker, position, op, cantidad, strict)
+
+        self.last_date = max(self.last_date, pd.Timestamp(op["fecha"]))
+
+    def to_frame(self):
+        rows = [
+            {
+                "ticker": ticker,
+                "cantidad": p.cantidad,
+                "costo_base": p.costo,
+                "precio_medio": p.precio_medio,
+                "realizado": p.realizado,
+            }
+            for ticker, p in self.positions.items()
+        ]
+        return pd.DataFrame(rows, columns=["ticker", "cantidad", "costo_base", "precio_medio", "realizado"])
+
+    def lots_frame(self, ticker=None):
+        """Lotes abiertos (todos o de un ticker). 'costo_base' usa el costo promedio si ese es el método."""
+        tickers = [ticker] if ticker is not None else list(self.positions)
+        rows = [
+            {
+                "lote_id": lot.id,
+                "ticker": t,
+                "fecha_compra": lot.fecha,
+                "cantidad": lot.cantidad,
+                "costo_unitario": lot.costo_unitario,
+                "costo_base": lot.cantidad * (self.positions[t].precio_medio if self.method == "PROMEDIO"
+                                              else lot.costo_unitario),
+            }
+            for t in tickers if t in self.positions
+            for lot in self.positions[t].lots.values()
+        ]
+        return pd.DataFrame(rows, columns=["lote_id", "ticker", "fecha_compra", "cantidad", "costo_unitario",
+                                           "costo_base"])
+
+    def realized_frame(self):
+        return pd.DataFrame(self.realized, columns=["venta_id", "ticker", "lote_id", "fecha_compra", "fecha_venta",
+                                                    "cantidad", "costo", "ingreso", "ganancia"])
+
+
+# ---------- Ledgers con ventas antiguas ----------
+# Antes, vender borraba todas las compras del ticker y dejaba una compra sintética (comisión 0, con
+# la fecha de la venta) con las acciones restantes y su costo TOTAL en "precio"; la venta guardaba en
+# "precio" lo que se había pagado por las acciones vendidas. Esas ventas ya están descontadas de las
+# compras: aplicarlas otra vez en el PositionBook las restaría dos veces. Las operaciones escritas con
+# las reglas actuales llevan "formato" = LEDGER_FORMAT; las de antes lo tienen vacío.
+LEDGER_FORMAT = 2
+LEGACY_PREFIX = "legado-"
+
+
+def _legacy(operations):
+    if "formato" not in operations.columns:
+        return pd.Series(True, index=operations.index)
+    return operations["formato"].isna()
+
+
+def legacy_sales(operations):
+    """Ventas registradas con las reglas antiguas (sin 'formato')"""
+    if operations.empty:
+        return operations.iloc[0:0]
+    return operations[(operations["tipo"] == "Venta") & _legacy(operations)]
+
+
+def legacy_purchases(operations):
+    """Compras sintéticas que dejaron las ventas antiguas.
+
+    Cada venta antigua borraba las compras anteriores del ticker, así que solo sobrevive la sintética
+    de la última: es la compra antigua del mismo ticker y día escrita justo antes de esa venta.
+    """
+    ventas = legacy_sales(operations)
+    antiguas = _legacy(operations)
+    sinteticas = []
+    ultimas = ventas.groupby(ventas["ticker"].astype(str)).tail(1)
+    for i in operations.index.get_indexer(ultimas.index):
+        if i == 0:
+            continue
+        venta, previa = operations.iloc[i], operations.iloc[i - 1]
+        if (previa["tipo"] == "Compra" and antiguas.iloc[i - 1] and str(previa["ticker"]) == str(venta["ticker"])
+                and pd.Timestamp(previa["fecha"]) == pd.Timestamp(venta["fecha"])):
+            sinteticas.append(i - 1)
+    return operations.iloc[sinteticas]
+
+
+def migrate_legacy_sales(operations, new_id):
+    """Cambios que pasan las operaciones antiguas al formato actual: devuelven (altas, bajas).
+
+    - La compra sintética se vuelve a registrar con su precio por acción (costo total / cantidad).
+    - Por cada venta antigua se añade una compra del mismo día que devuelve las acciones ya
+      descontadas, a su costo por acción, y la venta se vuelve a registrar consumiendo solo ese lote.
+      El precio de venta nunca se guardó, así que la venta lleva ese mismo costo (ganancia = -comisión).
+    - Las ventas nuevas que indicaban la compra sintética como lote pasan a apuntar a la nueva.
+    """
+    altas, bajas = [], []
+    renombradas = {}
+    for compra in legacy_purchases(operations).itertuples(index=False):
+        renombradas[compra.id] = f"{LEGACY_PREFIX}{compra.id}"
+        altas.append({"id": renombradas[compra.id], "fecha": compra.fecha, "ticker": str(compra.ticker),
+                      "cantidad": compra.cantidad, "precio": compra.precio / compra.cantidad, "tipo": "Compra",
+                      "comision": 0.0, "lotes": None, "formato": LEDGER_FORMAT})
+        bajas.append(compra.id)
+
+    for venta in legacy_sales(operations).itertuples(index=False):
+        lote_id = f"{LEGACY_PREFIX}{venta.id}"
+        costo_unitario = venta.precio / venta.cantidad
+        altas.append({"id": lote_id, "fecha": venta.fecha, "ticker": str(venta.ticker), "cantidad": venta.cantidad,
+                      "precio": costo_unitario, "tipo": "Compra", "comision": 0.0, "lotes": None,
+                      "formato": LEDGER_FORMAT})
+        altas.append({"id": new_id(), "fecha": venta.fecha, "ticker": str(venta.ticker), "cantidad": venta.cantidad,
+                      "precio": costo_unitario, "tipo": "Venta", "comision": venta.comision, "lotes": lote_id,
+                      "formato": LEDGER_FORMAT})
+        bajas.append(venta.id)
+
+    if renombradas:
+        nuevas = operations[(operations["tipo"] == "Venta") & ~_legacy(operations)]
+        for venta in nuevas.itertuples(index=False):
+            lotes = parse_lot_ids(venta.lotes)
+            if any(l in renombradas for l in lotes):
+                altas.append({**venta._asdict(), "id": new_id(), "ticker": str(venta.ticker), "tipo": "Venta",
+                              "lotes": ", ".join(renombradas.get(l, l) for l in lotes)})
+                bajas.append(venta.id)
+    return altas, bajas
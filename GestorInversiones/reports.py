@@ -1,83 +1,154 @@
+import numpy as np
 import pandas as pd
-from api_yfinance import get_current_price
-
-def generate_report(operations):
-    report = operations.copy() if not operations.empty else pd.DataFrame(columns=["fecha", "ticker", "cantidad", "precio", "tipo", "comision"])
-    
-    # Inicializar totales
-    total_invertido = 0
-    dinero_neto = 0
-    total_real = 0
-    
-    if not report.empty:
-        # Asegurar tipos numéricos
-        report['precio_compra'] = pd.to_numeric(report['precio'] * report['cantidad'], errors='coerce')
-        report['cantidad'] = pd.to_numeric(report['cantidad'], errors='coerce')
-        report['comision'] = pd.to_numeric(report['comision'], errors='coerce')
-
-        report['precio_actual'] = report['ticker'].apply(get_current_price)
-        report['valor_actual'] = report['cantidad'] * report['precio_actual']
-        report['ganancia_perdida'] = report['valor_actual'] - report['precio_compra']
-
-        # ↓↓↓ Filtrar solo compras activas para el resumen
-        compras_activas = report[report['tipo'] == 'Compra']
-
-        total_invertido = compras_activas['precio_compra'].sum()
-        dinero_neto = compras_activas['valor_actual'].sum()
-        total_real = dinero_neto - total_invertido
-
-    # Define columns to exclude
-    columns_to_exclude = ['comision', 'precio'] # Add any other columns you want to exclude here
-
-    # Drop the excluded columns from the main report DataFrame
-    # Use .reindex to handle cases where columns might not exist in an empty DataFrame
-    report_columns_before_exclusion = report.columns.tolist()
-    report = report.drop(columns=[col for col in columns_to_exclude if col in report.columns], errors='ignore')
-    
-    combined_df = pd.concat([report], ignore_index=True, sort=False)
-    
-    # Crear fila de resumen - SOLO con los totales en las columnas relevantes
-    # Ensure summary_row also excludes the specified columns
-    summary_data = {
-        'fecha': ['TOTALES'],
-        'ticker': [''],
-        'cantidad': [''],
-        'precio_compra': [total_invertido],  # Total invertido
-        'tipo': [''],
-        'precio_actual': [''],
-        'valor_actual': [dinero_neto],  # Dinero neto
-        'ganancia_perdida': [total_real],  # Total real
+from api_yfinance import get_current_prices
+from portfolio import valorar_posiciones, valorar_operaciones
+from positions import PositionBook
+
+# Columnas del reporte, en orden. 'precio_compra' es el costo base de la fila (ver build_report);
+# 'precio', 'comision', 'id', 'lotes' y 'formato' no se muestran.
+REPORT_COLUMNS = ['fecha', 'ticker', 'cantidad', 'cantidad_abierta', 'tipo', 'precio_actual', 'precio_compra',
+                  'valor_actual', 'ganancia_perdida']
+
+
+def build_report(operations, prices=None, posiciones=None):
+    """Filas del reporte (sin totales), valoradas con las posiciones como en el portfolio.
+
+    Una compra vale por las acciones de su lote que siguen abiertas y su 'precio_compra' es el costo
+    base de esas acciones, así que las compras suman lo mismo que TOTALES. Una venta no tiene valor
+    actual: 'precio_compra' es el costo de los lotes que consumió y 'ganancia_perdida' la realizada.
+    Sin `posiciones` se reconstruyen de `operations` (que entonces debe ser el ledger completo).
+    """
+    if operations.empty:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    if posiciones is None:
+        posiciones = PositionBook.from_operations(operations)
+
+    report = valorar_operaciones(operations, posiciones, prices)
+    # Fecha como texto AAAA-MM-DD en una pasada de NumPy (evita convertir Timestamps uno a uno al añadir TOTALES)
+    fechas = report['fecha']
+    if not pd.api.types.is_datetime64_any_dtype(fechas):
+        fechas = pd.to_datetime(fechas, errors='coerce')
+    fechas = fechas.to_numpy(dtype='datetime64[ns]')
+    report['fecha'] = np.datetime_as_string(fechas, unit='D')
+    report['ticker'] = report['ticker'].astype(object)
+    report['tipo'] = report['tipo'].astype(object)
+    report['precio_compra'] = report['costo_base']
+    return report[REPORT_COLUMNS].reset_index(drop=True)
+
+
+def report_totals(posiciones, prices=None):
+    """Totales del resumen sobre las acciones que siguen en cartera.
+
+    Salen de las posiciones, no de sumar las filas: las ventas ya descuentan acciones y costo base,
+    así que los totales coinciden con calculate_portfolio_metrics.
+    """
+    abiertas = valorar_posiciones(posiciones, prices)
+    abiertas = abiertas[abiertas['precio_actual'].notna()]  # igual que calculate_portfolio_metrics
+    total_invertido = float(abiertas['costo_base'].sum())
+    dinero_neto = float(abiertas['valor_actual'].sum())
+    return {
+        'precio_compra': total_invertido,  # Total invertido
+        'valor_actual': dinero_neto,  # Dinero neto
+        'ganancia_perdida': dinero_neto - total_invertido,  # Total real
     }
-    # Remove excluded columns from summary_data if they exist
-    for col in columns_to_exclude:
-        if col in summary_data:
-            del summary_data[col]
-
-    summary_row = pd.DataFrame(summary_data)
-    
-    # Asegurar que ambos DataFrames tengan las mismas columnas
-    all_columns = list(set(combined_df.columns) | set(summary_row.columns))
-    combined_df = combined_df.reindex(columns=all_columns, fill_value='')
-    summary_row = summary_row.reindex(columns=all_columns, fill_value='')
-    
-    # Combinar todo
-    final_report_df = pd.concat([combined_df, summary_row], ignore_index=True)
-    
-    # Definir el orden de columnas que quieres
-    # The 'precio' column is already used to calculate 'precio_compra'
-    # 'comision' is also explicitly excluded.
-    desired_order = ['fecha', 'ticker', 'cantidad', 'tipo', 'precio_actual', 'precio_compra', 'valor_actual', 'ganancia_perdida']
-    
-    # Reordenar las columnas, manteniendo solo las que existen
-    existing_columns = [col for col in desired_order if col in final_report_df.columns]
-    remaining_columns = [col for col in final_report_df.columns if col not in desired_order and col not in columns_to_exclude] # Ensure these are also excluded
-    
-    # Orden final: primero las deseadas, luego las restantes (which should now be empty of excluded columns)
-    final_column_order = existing_columns + remaining_columns
-    final_report_df = final_report_df[final_column_order]
-    
-    # Guardar el reporte
-    report_path = "reporte_inversiones.csv"
-    final_report_df.to_csv(report_path, index=False)
-    
-    return report_path, final_report_df
\ No newline at end of file
+
+
+def generate_report(operations, posiciones=None):
+    """Reporte de operaciones con precios actuales y una fila final de TOTALES"""
+    prices = get_current_prices(operations['ticker'].astype(object).dropna().unique()) if not operations.empty else {}
+    if posiciones is None:
+        posiciones = PositionBook.from_operations(operations)
+    report = build_report(operations, prices, posiciones)
+    return pd.concat([report, _summary_frame(report_totals(posiciones, prices))], ignore_index=True)
+
+
+def _summary_frame(totals):
+    # Las celdas vacías del resumen quedan como NaN para no convertir las columnas numéricas a object
+    return pd.DataFrame([dict(fecha='TOTALES', **totals)], columns=REPORT_COLUMNS)
+
+
+# ---------- Exportación por bloques ----------
+# Para ledgers muy grandes: el reporte se genera y escribe bloque a bloque, así que la memoria
+# no crece con el número de operaciones. Los totales salen de las posiciones (un agregado por ticker).
+REPORT_CHUNK_SIZE = 50_000
+REPORT_FORMATS = {"csv": "text/csv",
+                  "parquet": "application/vnd.apache.parquet",
+                  "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+XLSX_MAX_ROWS = 1_048_576  # límite de filas de una hoja de Excel
+
+
+def iter_report_chunks(operations, chunk_size=REPORT_CHUNK_SIZE, totals=None, posiciones=None):
+    """Generar el reporte en bloques de `chunk_size` filas; el último bloque es la fila de TOTALES.
+
+    Si se pasa `totals` (dict), al terminar queda con los totales del reporte. Sin `posiciones` se
+    reconstruyen del ledger con el método de costo por defecto.
+    """
+    prices = get_current_prices(operations['ticker'].astype(object).dropna().unique()) if not operations.empty else {}
+    if posiciones is None:
+        posiciones = PositionBook.from_operations(operations)
+    for start in range(0, len(operations), chunk_size):
+        yield build_report(operations.iloc[start:start + chunk_size], prices, posiciones)
+    resumen = report_totals(posiciones, prices)
+    if totals is not None:
+        totals.update(resumen)
+    yield _summary_frame(resumen)
+
+
+def iter_report_csv(operations, chunk_size=REPORT_CHUNK_SIZE, totals=None, posiciones=None):
+    """Reporte CSV como generador de bytes (cabecera, bloques de filas y TOTALES)"""
+    yield (",".join(REPORT_COLUMNS) + "\n").encode("utf-8")
+    for chunk in iter_report_chunks(operations, chunk_size, totals, posiciones):
+        yield chunk.to_csv(index=False, header=False).encode("utf-8")
+
+
+def preview_report(operations, n=100, posiciones=None):
+    """Primeras `n` filas del reporte (solo se cotizan los tickers que aparecen en ellas)"""
+    if posiciones is None:
+        posiciones = PositionBook.from_operations(operations)
+    return build_report(operations.head(n), posiciones=posiciones)
+
+
+def _write_csv(operations, path, chunk_size, totals, posiciones):
+    with open(path, "wb") as f:
+        for data in iter_report_csv(operations, chunk_size, totals, posiciones):
+            f.write(data)
+
+
+def _write_parquet(operations, path, chunk_size, totals, posiciones):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(col, pa.string() if col in ('fecha', 'ticker', 'tipo') else pa.float64())
+                        for col in REPORT_COLUMNS])
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_report_chunks(operations, chunk_size, totals, posiciones):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def _write_xlsx(operations, path, chunk_size, totals, posiciones):
+    from openpyxl import Workbook
+
+    # Libro en modo write_only: las filas se vuelcan al disco a medida que se añaden
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Reporte")
+    ws.append(REPORT_COLUMNS)
+    for chunk in iter_report_chunks(operations, chunk_size, totals, posiciones):
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+            ws.append(list(row))
+    wb.save(path)
+
+
+_WRITERS = {"csv": _write_csv, "parquet": _write_parquet, "xlsx": _write_xlsx}
+
+
+def export_report(operations, path, fmt=None, chunk_size=REPORT_CHUNK_SIZE, posiciones=None):
+    """Escribir el reporte por bloques en CSV, Parquet o XLSX. Devuelve los totales."""
+    fmt = (fmt or path.rsplit(".", 1)[-1]).lower()
+    if fmt not in _WRITERS:
+        raise ValueError(f"Formato de reporte no soportado: {fmt}")
+    if fmt == "xlsx" and len(operations) + 2 > XLSX_MAX_ROWS:
+        raise ValueError(f"Demasiadas operaciones para una hoja de Excel ({len(operations)}); usa CSV o Parquet")
+
+    totals = {}
+    _WRITERS[fmt](operations, path, chunk_size, totals, posiciones)
+    return totals
@@ -0,0 +1,251 @@
+# risk.py
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from api_yfinance import get_close_history
+from valuation import portfolio_value_history
+
+TRADING_DAYS = 252
+DEFAULT_BENCHMARK = "^GSPC"
+ROLLING_WINDOW = 21       # días hábiles de la volatilidad móvil (~1 mes)
+VAR_CONFIDENCE = 0.95
+RISK_FREE_RATE = 0.0      # tasa libre de riesgo anual
+
+
+def portfolio_returns(history):
+    """Rendimientos diarios ponderados en el tiempo: descuentan los aportes y retiros de cada día"""
+    valor = history['valor'].to_numpy(dtype=float)
+    flujos = np.diff(history['invertido'].to_numpy(dtype=float), prepend=0.0)
+    anterior = np.concatenate([[np.nan], valor[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = (valor - flujos) / anterior - 1
+    returns[~(anterior > 0)] = np.nan
+    return pd.Series(returns, index=history.index, name='rendimiento').dropna()
+
+
+def rolling_volatility(returns, window=ROLLING_WINDOW):
+    """Volatilidad móvil anualizada con sumas acumuladas (sin recorrer ventana a ventana)"""
+    r = np.asarray(returns, dtype=float)
+    if len(r) < window:
+        return pd.Series(np.nan, index=getattr(returns, 'index', None))
+    s1 = np.cumsum(np.concatenate([[0.0], r]))
+    s2 = np.cumsum(np.concatenate([[0.0], r * r]))
+    suma, suma2 = s1[window:] - s1[:-window], s2[window:] - s2[:-window]
+    varianza = np.maximum((suma2 - suma * suma / window) / (window - 1), 0.0)
+    vol = np.concatenate([np.full(window - 1, np.nan), np.sqrt(varianza * TRADING_DAYS)])
+    return pd.Series(vol, index=getattr(returns, 'index', None), name='volatilidad')
+
+
+def _asset_sums(M, b):
+    """Sumas por ticker de una matriz de rendimientos (días x tickers) y del benchmark `b` (días).
+
+    'n', 'm', 'm2' cuentan todos los días con dato del ticker (volatilidad); los demás solo los
+    días con dato de ambos (beta).
+    """
+    valid = ~np.isnan(M)
+    pair = valid & ~np.isnan(b)[:, None]
+    Mz = np.where(valid, M, 0.0)
+    Mp, bp = np.where(pair, M, 0.0), np.where(pair, b[:, None], 0.0)
+    return {
+        'n': valid.sum(axis=0), 'm': Mz.sum(axis=0), 'm2': (Mz * Mz).sum(axis=0),
+        'n_b': pair.sum(axis=0), 'mp': Mp.sum(axis=0), 'b': bp.sum(axis=0), 'b2': (bp * bp).sum(axis=0),
+        'mb': (Mp * bp).sum(axis=0),
+    }
+
+
+def _asset_frame(tickers, sums):
+    n, n_b = sums['n'], sums['n_b']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_m = np.maximum((sums['m2'] - sums['m'] ** 2 / n) / (n - 1), 0.0)
+        vol = np.where(n > 1, np.sqrt(var_m * TRADING_DAYS), np.nan)
+        var_b = (sums['b2'] - sums['b'] ** 2 / n_b) / (n_b - 1)
+        cov = (sums['mb'] - sums['mp'] * sums['b'] / n_b) / (n_b - 1)
+        beta = np.where((n_b > 1) & (var_b > 0), cov / var_b, np.nan)
+    return pd.DataFrame({'ticker': list(tickers), 'volatilidad': vol, 'beta': beta})
+
+
+def asset_risk(closes, benchmark_returns):
+    """Volatilidad anualizada y beta de cada ticker, en bloque sobre la matriz de rendimientos"""
+    R = closes.ffill().pct_change(fill_method=None).iloc[1:]
+    b = benchmark_returns.reindex(R.index).to_numpy(dtype=float)
+    return _asset_frame(R.columns, _asset_sums(R.to_numpy(dtype=float), b))
+
+
+class RiskState:
+    """Acumuladores de las métricas de riesgo para añadir días nuevos sin recalcular todo.
+
+    Guarda sumas (n, Σr, Σr², Σ bajista², Σrb, Σb, Σb²), el máximo y la caída máxima de la
+    curva de riqueza, los rendimientos ordenados (VaR histórico), la última ventana móvil, la
+    serie de rendimientos, las sumas por ticker (ver _asset_sums) y el último cierre conocido de
+    cada ticker y del benchmark. La última barra se deshace y se vuelve a aplicar en cada
+    actualización: si se calculó con un cierre parcial del día, el cierre definitivo la reemplaza.
+    """
+
+    def __init__(self, window=ROLLING_WINDOW, risk_free=RISK_FREE_RATE, ledger_key=None):
+        self.window = window
+        self.rf_daily = (1 + risk_free) ** (1 / TRADING_DAYS) - 1
+        self.ledger_key = ledger_key
+        self.last_date = None
+        self.n = 0
+        self.sum_r = self.sum_r2 = self.sum_down2 = 0.0
+        self.n_b = 0
+        self.sum_b = self.sum_b2 = self.sum_rb = self.sum_r_bench = 0.0
+        self.wealth = 1.0
+        self.peak = 1.0
+        self.max_drawdown = 0.0
+        self.sorted_returns = np.array([])
+        self.tail = np.array([])
+        self.returns = pd.Series(dtype=float, name='rendimiento')
+        self.asset_sums = None
+        self.closes_date = None                    # hasta dónde llegan las sumas por ticker
+        self.last_closes = None                    # cierres (ffill) de los tickers en closes_date
+        self.last_bench_close = np.nan             # ídem del benchmark
+        self._before_last = None  # estado previo a la última barra aplicada
+
+    @property
+    def anchor(self):
+        """Fecha hasta la que el estado es definitivo (la de la barra previa a la última)"""
+        return self._before_last['last_date'] if self._before_last else None
+
+    def update(self, returns, benchmark=None, closes=None, bench_close=None):
+        """Incorporar los rendimientos posteriores a `last_date` (y los del benchmark alineados).
+
+        `closes` y `bench_close` son los cierres con ffill de los tickers y del benchmark; de ellos
+        salen las sumas por ticker. Antes se restaura el estado previo a la última barra, que se
+        vuelve a aplicar con su valor actual.
+        """
+        if self._before_last is not None:
+            self.__dict__.update(self._before_last)
+        if self.last_date is not None:
+            returns = returns[returns.index > self.last_date]
+        if returns.empty:
+            return self
+        asset_returns = closes.pct_change(fill_method=None) if closes is not None else None
+        corte = returns.index[-2] if len(returns) > 1 else self.last_date
+        self._apply(returns.iloc[:-1], benchmark, asset_returns, closes, bench_close, corte)
+        # Copia superficial: los arrays se reemplazan, nunca se modifican en su sitio
+        self._before_last = {k: v for k, v in self.__dict__.items() if k != '_before_last'}
+        final = returns.index[-1] if closes is None or closes.empty else max(returns.index[-1], closes.index[-1])
+        self._apply(returns.iloc[-1:], benchmark, asset_returns, closes, bench_close, final)
+        return self
+
+    def _apply_assets(self, asset_returns, benchmark, closes, bench_close, hasta):
+        R = asset_returns[asset_returns.index <= hasta]
+        if self.closes_date is not None:
+            R = R[R.index > self.closes_date]
+        b = (benchmark.reindex(R.index) if benchmark is not None else pd.Series(np.nan, index=R.index))
+        sums = _asset_sums(R.to_numpy(dtype=float), b.to_numpy(dtype=float))
+        if self.asset_sums is not None:
+            sums = {k: self.asset_sums[k] + v for k, v in sums.items()}
+        self.asset_sums = sums
+        self.closes_date = hasta
+        self.last_closes = closes[closes.index <= hasta].iloc[-1]
+        previos = bench_close[bench_close.index <= hasta] if bench_close is not None else ()
+        self.last_bench_close = previos.iloc[-1] if len(previos) else np.nan
+
+    def _apply(self, returns, benchmark, asset_returns=None, closes=None, bench_close=None, hasta=None):
+        if asset_returns is not None and hasta is not None:
+            self._apply_assets(asset_returns, benchmark, closes, bench_close, hasta)
+        if returns.empty:
+            return
+        self.returns = pd.concat([self.returns, returns]) if len(self.returns) else returns.rename('rendimiento')
+        r = returns.to_numpy(dtype=float)
+
+        self.n += len(r)
+        self.sum_r += r.sum()
+        self.sum_r2 += (r * r).sum()
+        self.sum_down2 += (np.minimum(r - self.rf_daily, 0.0) ** 2).sum()
+
+        if benchmark is not None:
+            b = benchmark.reindex(returns.index).to_numpy(dtype=float)
+            ok = ~np.isnan(b)
+            self.n_b += ok.sum()
+            self.sum_b += b[ok].sum()
+            self.sum_b2 += (b[ok] ** 2).sum()
+            self.sum_rb += (r[ok] * b[ok]).sum()
+            self.sum_r_bench += r[ok].sum()
+
+        # Drawdown: se continúa la curva de riqueza desde el último nivel y el último máximo
+        wealth = self.wealth * np.cumprod(1 + r)
+        peaks = np.maximum.accumulate(np.concatenate([[self.peak], wealth]))[1:]
+        self.max_drawdown = min(self.max_drawdown, (wealth / peaks - 1).min())
+        self.wealth, self.peak = wealth[-1], peaks[-1]
+
+        chunk = np.sort(r)
+        self.sorted_returns = np.insert(self.sorted_returns, np.searchsorted(self.sorted_returns, chunk), chunk)
+        self.tail = np.concatenate([self.tail, r])[-self.window:]
+        self.last_date = returns.index[-1]
+
+    def metrics(self, confidence=VAR_CONFIDENCE):
+        if self.n < 2:
+            return {}
+        mean = self.sum_r / self.n
+        std = np.sqrt(max((self.sum_r2 - self.n * mean * mean) / (self.n - 1), 0.0))
+        downside = np.sqrt(self.sum_down2 / self.n)
+        exceso = (mean - self.rf_daily) * TRADING_DAYS
+        anual = np.sqrt(TRADING_DAYS)
+
+        beta = np.nan
+        if self.n_b > 1:
+            mean_b, mean_rb = self.sum_b / self.n_b, self.sum_r_bench / self.n_b
+            var_b = (self.sum_b2 - self.n_b * mean_b * mean_b) / (self.n_b - 1)
+            cov = (self.sum_rb - self.n_b * mean_rb * mean_b) / (self.n_b - 1)
+            beta = cov / var_b if var_b > 0 else np.nan
+
+        z = NormalDist().inv_cdf(1 - confidence)
+        return {
+            'volatilidad': std * anual,
+            'volatilidad_movil': np.std(self.tail, ddof=1) * anual if len(self.tail) == self.window else np.nan,
+            'sharpe': exceso / (std * anual) if std > 0 else np.nan,
+            'sortino': exceso / (downside * anual) if downside > 0 else np.nan,
+            'max_drawdown': self.max_drawdown,
+            'beta': beta,
+            # VaR diario como pérdida positiva (fracción del valor de la cartera)
+            'var_historico': -np.quantile(self.sorted_returns, 1 - confidence),
+            'var_parametrico': -(mean + z * std),
+            'dias': self.n,
+        }
+
+
+def ledger_key(operations):
+    """Huella del ledger: si cambia, el estado acumulado ya no sirve"""
+    return int(pd.util.hash_pandas_object(operations['id'], index=False).sum()) if not operations.empty else 0
+
+
+def compute_risk(operations, benchmark=DEFAULT_BENCHMARK, state=None):
+    """Métricas de riesgo de la cartera.
+
+    Con un `state` del mismo ledger y benchmark solo se leen y valoran los cierres posteriores a
+    su ancla (la barra previa a la última): la cartera se valora desde los últimos cierres
+    guardados y las sumas por ticker continúan desde ahí. Sin él se parte de la primera operación.
+    Devuelve (métricas, estado, rendimientos diarios, riesgo por ticker).
+    """
+    key = (ledger_key(operations), benchmark)
+    if state is None or state.ledger_key != key or state.anchor is None:
+        state = RiskState(ledger_key=key)
+    if operations.empty:
+        return {}, state, state.returns, pd.DataFrame()
+
+    ancla = state.anchor
+    start = ancla if ancla is not None else pd.to_datetime(operations['fecha']).min()
+    closes = get_close_history(operations['ticker'].astype(object).dropna().unique(), start)
+    bench_close = get_close_history([benchmark], start)[benchmark] if benchmark else pd.Series(dtype=float)
+    if ancla is not None:
+        # Los cierres guardados en el ancla hacen de fila inicial: el ffill, las posiciones acumuladas
+        # y los rendimientos siguen igual que si se hubiera descargado todo el histórico
+        previos = state._before_last
+        closes = pd.concat([pd.DataFrame([previos['last_closes'].reindex(closes.columns).to_numpy()],
+                                         index=pd.DatetimeIndex([ancla]), columns=closes.columns),
+                            closes[closes.index > ancla]])
+        bench_close = pd.concat([pd.Series([previos['last_bench_close']], index=pd.DatetimeIndex([ancla])),
+                                 bench_close[bench_close.index > ancla]])
+    closes, bench_close = closes.ffill(), bench_close.ffill()
+
+    returns = portfolio_returns(portfolio_value_history(operations, closes))
+    state.update(returns, bench_close.pct_change(fill_method=None), closes, bench_close)
+    if state.n == 0:
+        return {}, state, state.returns, pd.DataFrame()
+    per_asset = _asset_frame(closes.columns, state.asset_sums) if state.asset_sums is not None else pd.DataFrame()
+    return state.metrics(), state, state.returns, per_asset
@@ -0,0 +1,62 @@
+# valuation.py
+import numpy as np
+import pandas as pd
+
+from api_yfinance import get_close_history
+
+
+def _daily_matrix(operations, values, dates, tickers):
+    """Sumar `values` por (fecha, ticker) en una matriz fechas x tickers alineada a `dates`.
+
+    Las operaciones en días sin cotización cuentan desde el siguiente día hábil (o desde el
+    último disponible si todavía no hay cierre para su fecha).
+    """
+    rows = np.searchsorted(dates.to_numpy(), operations['fecha'].to_numpy(dtype='datetime64[ns]'))
+    rows = np.minimum(rows, len(dates) - 1)
+    cols = pd.Index(tickers).get_indexer(operations['ticker'].astype(object))
+    known = cols >= 0
+    matrix = np.zeros((len(dates), len(tickers)))
+    np.add.at(matrix, (rows[known], cols[known]), values[known])
+    return matrix
+
+
+def portfolio_value_history(operations, closes):
+    """Valor diario de la cartera y capital neto aportado a partir del ledger y de los cierres.
+
+    `closes` es una matriz fechas x tickers. Devuelve un DataFrame indexado por fecha con
+    'valor' (posiciones x cierre del día) e 'invertido' (compras menos ventas, con comisiones).
+    """
+    if operations.empty or closes.empty:
+        return pd.DataFrame(columns=['valor', 'invertido'], index=pd.DatetimeIndex([], name='fecha'))
+
+    ops = operations.assign(fecha=pd.to_datetime(operations['fecha']).dt.normalize())
+    dates = closes.index
+    tickers = list(closes.columns)
+
+    cantidad = ops['cantidad'].to_numpy(dtype=float)
+    precio = ops['precio'].to_numpy(dtype=float)
+    comision = ops['comision'].fillna(0).to_numpy(dtype=float)
+    signo = np.where(ops['tipo'].astype(object).to_numpy() == 'Venta', -1.0, 1.0)
+
+    # Posición de cada ticker en cada fecha = suma acumulada de las compras/ventas hasta ese día
+    positions = np.cumsum(_daily_matrix(ops, signo * cantidad, dates, tickers), axis=0)
+    np.maximum(positions, 0, out=positions)
+
+    # Días sin cierre de un ticker (feriados de su mercado) usan el último cierre conocido
+    prices = closes.ffill().to_numpy(dtype=float)
+    valor = np.nansum(positions * prices, axis=1)
+
+    # Las compras aportan precio + comisión; las ventas retiran el ingreso neto de comisión
+    flujos = signo * cantidad * precio + comision
+    invertido = np.cumsum(_daily_matrix(ops, flujos, dates, tickers).sum(axis=1))
+
+    return pd.DataFrame({'valor': valor, 'invertido': invertido}, index=dates.rename('fecha'))
+
+
+def get_portfolio_history(operations):
+    """Serie histórica de valor de la cartera desde la primera operación hasta hoy"""
+    if operations.empty:
+        return portfolio_value_history(operations, pd.DataFrame())
+    start = pd.to_datetime(operations['fecha']).min()
+    closes = get_close_history(operations['ticker'].astype(object).dropna().unique(), start)
+    return portfolio_value_history(operations, closes)